@@ -0,0 +1,221 @@
+"""
+Benchmarks of the builder, the environments and the GA across strut counts.
+
+Run from the root of the repository, e.g.
+
+    python -m benchmarks.run_benchmarks --struts 2 4 8 16 32 64 --output bench.json
+    python -m benchmarks.run_benchmarks --compare old.json new.json
+
+Results are written as JSON with one record per (benchmark, struts), so that runs on different commits
+can be compared with `--compare`.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import mujoco
+from src.TensegrityModel.tensegrity_builder import Tensegrity
+from src.TensegrityModel.envs import TensegVectorEnv, TensegSharedMemoryVectorEnv
+from src.TensegrityModel.tensegrity_ga import TensegrityGA, StabilityEvaluator
+
+
+def best_time(fn, repeat):
+    """Best wall time of `repeat` calls of fn"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def random_design(struts, seed=0):
+    ga = TensegrityGA(struts, random_state=seed, cache_size=0)
+    nodes, bars, cables, actuators = ga.decode(ga.create_individual())
+    return Tensegrity('bench', nodes, bars, cables, actuators, stiffness=1, damping=.05)
+
+
+def bench_build(struts, args):
+    design = random_design(struts)
+    xml = design.to_xml_string()
+    return {
+        "xml_s": best_time(design.to_xml_string, args.repeat),
+        "compile_s": best_time(lambda: mujoco.MjModel.from_xml_string(xml), args.repeat),
+        "model_s": best_time(design.create_model, args.repeat),
+        "xml_bytes": len(xml),
+    }
+
+
+def bench_env(struts, args):
+    design = random_design(struts)
+    model = design.create_model()
+    result = {}
+
+    for name, kwargs in (("single", {}), ("single_fast", dict(reuse_obs_buffer=True, verbose_info=False))):
+        env = design.make_env(**kwargs)
+        env.reset(seed=0)
+        action = np.zeros(env.action_space.shape)
+
+        def run():
+            for _ in range(args.steps):
+                _, _, terminated, _, _ = env.step(action)
+                if terminated:
+                    env.reset()
+
+        result[name + "_steps_per_s"] = args.steps / best_time(run, args.repeat)
+        env.close()
+
+    for name, make in (
+            ("thread_vector", lambda: TensegVectorEnv(model, len(design._bars), args.num_envs)),
+            ("shared_memory_vector", lambda: TensegSharedMemoryVectorEnv(model, len(design._bars), args.num_envs)),
+    ):
+        env = make()
+        env.reset(seed=0)
+        actions = np.zeros(env.action_space.shape)
+
+        def run():
+            for _ in range(args.steps):
+                env.step(actions)
+
+        result[name + "_steps_per_s"] = args.num_envs * args.steps / best_time(run, args.repeat)
+        env.close()
+
+    return result
+
+
+def bench_operators(struts, args):
+    ga = TensegrityGA(struts, population_size=args.operator_population, random_state=0, cache_size=0)
+    ga.create_initial_population()
+    genes = ga._genes
+    ga._fitness = ga._rng.random(len(genes))
+    ga.rank_population()
+
+    decode_s = best_time(lambda: [ga.decode(gene) for gene in genes], args.repeat)
+    decode_batch_s = best_time(lambda: ga.decode_batch(genes), args.repeat)
+    create_s = best_time(lambda: ga.create_population(len(genes)), args.repeat)
+
+    def breed():
+        ga._genes, ga._fitness = genes, np.sort(ga._fitness)[::-1]
+        ga.create_new_population()
+
+    breed_s = best_time(breed, args.repeat)
+    return {
+        "population": len(genes),
+        "decode_per_s": len(genes) / decode_s,
+        "decode_batch_per_s": len(genes) / decode_batch_s,
+        "create_population_per_s": len(genes) / create_s,
+        "new_population_s": breed_s,
+    }
+
+
+def bench_fitness(struts, args):
+    result = {}
+    for name, n_workers, parallel_type in (
+            ("serial", 1, "processing"),
+            ("thread", args.workers, "thread"),
+            ("process", args.workers, "processing"),
+    ):
+        ga = TensegrityGA(struts, population_size=args.fitness_population, random_state=0, cache_size=0,
+                          stability=StabilityEvaluator(max_steps=args.fitness_steps))
+        ga.create_initial_population()
+        ga.open_pool(n_workers=n_workers, parallel_type=parallel_type)
+        try:
+            # the first generation also pays for starting the workers
+            start = time.perf_counter()
+            ga.calculate_population_fitness(n_workers=n_workers, parallel_type=parallel_type)
+            first = time.perf_counter() - start
+            ga.rank_population()
+            ga.create_new_population()
+            start = time.perf_counter()
+            ga.calculate_population_fitness(n_workers=n_workers, parallel_type=parallel_type)
+            generation = time.perf_counter() - start
+        finally:
+            ga.close_pool()
+        result[name + "_first_generation_s"] = first
+        result[name + "_generation_s"] = generation
+        result[name + "_evals_per_s"] = args.fitness_population / generation
+    return result
+
+
+BENCHMARKS = {
+    "build": bench_build,
+    "env": bench_env,
+    "operators": bench_operators,
+    "fitness": bench_fitness,
+}
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "mujoco": mujoco.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def compare(old_path, new_path):
+    """Print the ratio new / old of every metric in two result files"""
+    with open(old_path) as f:
+        old = {(r["benchmark"], r["struts"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {(r["benchmark"], r["struts"]): r for r in json.load(f)["results"]}
+
+    for key in sorted(old.keys() & new.keys()):
+        for metric, value in new[key].items():
+            if metric in ("benchmark", "struts") or not isinstance(value, (int, float)):
+                continue
+            previous = old[key].get(metric)
+            if previous:
+                print("%-10s %4d  %-36s %12.4g -> %12.4g  x%.2f" % (key + (metric, previous, value, value / previous)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--struts", type=int, nargs="+", default=[2, 4, 8, 16, 32, 64])
+    parser.add_argument("--benchmarks", nargs="+", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3, help="timings are the best of this many runs")
+    parser.add_argument("--steps", type=int, default=200, help="env steps per timing")
+    parser.add_argument("--num-envs", type=int, default=8, help="envs in vectorized benchmarks")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="workers in parallel fitness")
+    parser.add_argument("--operator-population", type=int, default=1000)
+    parser.add_argument("--fitness-population", type=int, default=16)
+    parser.add_argument("--fitness-steps", type=int, default=100, help="max steps of each stability rollout")
+    parser.add_argument("--output", default=None, help="JSON file of results. defaults to stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    for struts in args.struts:
+        for name in args.benchmarks:
+            print("%s, %d struts" % (name, struts), file=sys.stderr)
+            record = {"benchmark": name, "struts": struts}
+            record.update(BENCHMARKS[name](struts, args))
+            results.append(record)
+
+    report = {"meta": metadata(args), "results": results}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Checks of behaviour the GA and the environments rely on, which the benchmarks do not cover.
+
+Run from the root of the repository, e.g.
+
+    python -m benchmarks.run_checks
+    python -m benchmarks.run_checks --checks prefilter
+
+Every check prints what it measured and raises `AssertionError` when it fails.
+"""
+import argparse
+import sys
+import tempfile
+import warnings
+import numpy as np
+from src.TensegrityModel.tensegrity_builder import Tensegrity
+from src.TensegrityModel.envs import TensegVectorEnv, TensegSharedMemoryVectorEnv
+from src.TensegrityModel.tensegrity_ga import TensegrityGA, EquilibriumPrefilter, SurrogateModel
+
+try:
+    from gymnasium.wrappers.vector import RecordEpisodeStatistics
+except ImportError:
+    # Gymnasium < 1.0, where the wrapper handles single and vectorized envs
+    from gymnasium.wrappers import RecordEpisodeStatistics
+
+
+def tbar():
+    nodes = np.array([[-1, 0, 0], [1, 0, 0], [0, -1, 0], [0, 1, 0]])
+    return Tensegrity('tbar', nodes, np.array([[0, 1], [2, 3]]), np.array([[0, 2], [0, 3], [1, 2], [1, 3]]),
+                      np.arange(4), stiffness=.1, damping=.05, ctrl_range=1)
+
+
+def check_episode_statistics(make_env, name, episode_steps=10, num_envs=2):
+    """Episodes of a vectorized env truncated after `episode_steps` are all reported with that length, without
+    warnings of the wrapper, and with the final observation of each finished env
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        env = RecordEpisodeStatistics(make_env(episode_steps, num_envs))
+        env.reset(seed=0)
+        lengths = []
+        for _ in range(2 * episode_steps + 5):
+            _, _, _, truncated, info = env.step(np.zeros(env.action_space.shape))
+            if "episode" in info:
+                lengths.extend(info["episode"]["l"][info["_episode"]])
+                final_key = "final_obs" if "final_obs" in info else "final_observation"
+                assert info["_" + final_key].tolist() == truncated.tolist(), "final observations are not masked"
+                assert all(obs is not None for obs in info[final_key][truncated]), "final observation missing"
+                assert "final_info" in info and "_final_info" in info, "final info missing"
+        env.close()
+    messages = [str(warning.message) for warning in caught if "autoreset" in str(warning.message).lower()]
+    print("%s: episode lengths %s, %d autoreset warnings" % (name, lengths, len(messages)))
+    assert not messages, messages
+    assert lengths == [episode_steps] * (2 * num_envs), "episode lengths are miscounted"
+
+
+def check_vector_env(args):
+    """Vectorized envs work under the `RecordEpisodeStatistics` of the installed Gymnasium"""
+    model = tbar().create_model()
+    check_episode_statistics(lambda steps, num_envs: TensegVectorEnv(
+        model, 2, num_envs, max_episode_steps=steps, terminate_when_unhealthy=False), "TensegVectorEnv")
+    check_episode_statistics(lambda steps, num_envs: TensegSharedMemoryVectorEnv(
+        model, 2, num_envs, n_workers=2, max_episode_steps=steps, terminate_when_unhealthy=False),
+        "TensegSharedMemoryVectorEnv")
+
+
+def check_prefilter(args):
+    """The pre-filter rejects a minority of decoded designs, and none of those the simulator finds stable"""
+    prefilter = EquilibriumPrefilter()
+    for struts in (2, 3, 6):
+        ga = TensegrityGA(struts, random_state=0, cache_size=0)
+        genes = ga.create_population(args.designs)
+        rejected = [gene for gene in genes if not prefilter.check(*ga.decode(gene)[:3]).feasible]
+        stable = sum(bool(ga._evaluate_timed(gene)[1].stable) for gene in rejected[:args.simulated])
+        rate = len(rejected) / len(genes)
+        print("prefilter, %d struts: %.1f %% rejected, %d of %d simulated stable"
+              % (struts, 100 * rate, stable, min(len(rejected), args.simulated)))
+        assert rate < .5, "the pre-filter rejects most decoded designs"
+        assert stable == 0, "the pre-filter rejects stable designs"
+
+
+def check_resume(args):
+    """A run resumed from a checkpoint, with a surrogate and the default in-memory fitness cache, ends with the
+    population of the uninterrupted run
+    """
+    def run(generations, directory, resume=False):
+        ga = TensegrityGA(2, population_size=args.population, generations=generations, random_state=0,
+                          checkpoint_dir=directory, surrogate=SurrogateModel(min_samples=args.population))
+        ga.run(n_workers=1, parallel_type="threading", resume=resume)
+        return ga
+
+    with tempfile.TemporaryDirectory() as full, tempfile.TemporaryDirectory() as split:
+        expected = run(args.generations, full)
+        run(args.generations // 2, split)
+        resumed = run(args.generations, split, resume=True)
+    same = np.array_equal(expected._genes, resumed._genes) and np.array_equal(expected._fitness, resumed._fitness)
+    print("resume, %d generations: surrogate samples %d and %d, same population %s"
+          % (args.generations, expected.surrogate_stats["samples"], resumed.surrogate_stats["samples"], same))
+    assert same, "a resumed run differs from the uninterrupted run"
+
+
+CHECKS = {
+    "prefilter": check_prefilter,
+    "resume": check_resume,
+    "vector_env": check_vector_env,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", nargs="+", choices=sorted(CHECKS), default=sorted(CHECKS))
+    parser.add_argument("--designs", type=int, default=1000, help="decoded designs per strut count")
+    parser.add_argument("--simulated", type=int, default=50, help="max rejected designs simulated")
+    parser.add_argument("--population", type=int, default=10, help="population size of the resumed run")
+    parser.add_argument("--generations", type=int, default=6, help="generations of the resumed run")
+    args = parser.parse_args(argv)
+
+    for name in args.checks:
+        print(name, file=sys.stderr)
+        CHECKS[name](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,7 @@ from src.TensegrityModel.tensegrity_builder import Tensegrity
 import os.path as osp
 
 dirname = osp.dirname(__file__)
-des = '/home/oscar/anaconda3/envs/gym/lib/python3.8/site-packages/gymnasium/envs/mujoco/assets'
-test_ga = ga.TensegrityGA(6, gym_des=des, dirname=dirname, verbose=True)
+test_ga = ga.TensegrityGA(6, verbose=True)
 
 test_ga.run(n_workers=1)
 print(test_ga.best_individual[0])
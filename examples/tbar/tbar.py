@@ -1,7 +1,5 @@
 from src.TensegrityModel.tensegrity_builder import Tensegrity
-from src.TensegrityModel.envs import TensegEnv
 import os.path as osp
-import gymnasium as gym
 import numpy as np
 
 nodes = np.array([
@@ -18,13 +16,11 @@ cables = np.array([[0, 2], [0, 3], [1, 2], [1, 3]])
 actuators = np.array([0, 1, 2, 3])
 
 dirname = osp.dirname(__file__)
-des = '/home/oscar/anaconda3/envs/gym/lib/python3.8/site-packages/gymnasium/envs/mujoco/assets'
 tbar = Tensegrity('tbar', nodes, bars, cables, actuators,
                   path=dirname, solver="Newton", integrator="RK4", stiffness=.1, damping=.05, ctrl_range=1)
 tbar.create_xml()
-tbar.register_gym(des)
 
-env = gym.make(tbar.get_name, xml_file=tbar.get_filename, bar_num=2)
+env = tbar.make_env(max_episode_steps=1000)
 observation, info = env.reset()
 
 for _ in range(1000):
@@ -36,5 +32,3 @@ for _ in range(1000):
 
 print(info)
 env.close()
-
-tbar.clean(des)
@@ -1 +1,6 @@
-from src.TensegrityModel.envs import tensegrity_gym
+from src.TensegrityModel.lazy_import import lazy_attributes
+
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "envs": "src.TensegrityModel.envs",
+    "tensegrity_gym": "src.TensegrityModel.envs.tensegrity_gym",
+})
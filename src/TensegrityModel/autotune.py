@@ -0,0 +1,106 @@
+import itertools
+import time
+from collections import namedtuple
+import numpy as np
+import mujoco
+from src.TensegrityModel.model_cache import TopologyModelCache
+from src.TensegrityModel.tensegrity_builder import Tensegrity
+
+# options varied by the tuner, all keyword arguments of `Tensegrity`
+TUNED_OPTIONS = ("solver", "integrator", "timestep", "iterations", "jacobian")
+
+TuningResult = namedtuple('TuningResult', ['options', 'error', 'speed', 'matches'])
+
+
+def default_grid():
+    """
+    Solver, integrator, timestep, solver iterations and Jacobian settings tried by `autotune`
+
+    Returns: list of dicts of `Tensegrity` options
+
+    """
+    integrators = ["Euler", "RK4"]
+    if hasattr(mujoco.mjtIntegrator, "mjINT_IMPLICITFAST"):
+        integrators.append("implicitfast")
+    return [
+        dict(solver=solver, integrator=integrator, timestep=timestep, iterations=iterations, jacobian=jacobian)
+        for solver, integrator, timestep, iterations, jacobian in itertools.product(
+            ["Newton", "CG", "PGS"], integrators, [0.002, 0.004], [20, 100], ["dense", "sparse"])
+    ]
+
+
+def with_options(tensegrity, **options):
+    """Copy of a tensegrity with some of its options replaced, and without xml path"""
+    return Tensegrity(tensegrity.get_name, tensegrity.nodes, tensegrity.bars, tensegrity.cables,
+                      tensegrity.actuators, **dict(tensegrity.options, **options))
+
+
+def _rollout(model, times, repeats):
+    """Positions of the bars at `times` with zero control, and the best wall time of `repeats` rollouts"""
+    data = mujoco.MjData(model)
+    bar_ids = [model.body("bar%d" % (i + 1)).id for i in range(model.nbody - 1)]
+    positions = np.empty((len(times), len(bar_ids), 3))
+    best = np.inf
+    for _ in range(repeats):
+        mujoco.mj_resetData(model, data)
+        start = time.perf_counter()
+        for i, t in enumerate(times):
+            # the first step ending at or after t, up to half a timestep early
+            while data.time < t - model.opt.timestep / 2:
+                mujoco.mj_step(model, data)
+            # centers of mass, i.e. the bar centers, rather than body frame origins
+            positions[i] = data.xipos[bar_ids]
+        best = min(best, time.perf_counter() - start)
+    diverged = data.warning[mujoco.mjtWarning.mjWARN_BADQACC].number > 0 or not np.all(np.isfinite(positions))
+    return positions, best, diverged
+
+
+def autotune(tensegrity, grid=None, duration=2.0, tol=1e-2, interval=0.02, repeats=1):
+    """
+    Find the fastest simulation options of a tensegrity that reproduce its own options
+    Args:
+        tensegrity: `Tensegrity`, whose options give the reference rollout
+        grid: list of dicts of options to try, see `TUNED_OPTIONS`. defaults to `default_grid()`
+        duration: simulated seconds of each rollout
+        tol: max distance in meters between the centers of a bar in a rollout and in the reference one
+        interval: seconds between the compared positions
+        repeats: number of timed rollouts of each option, the fastest one is kept
+
+    Returns: `TuningResult` of the fastest matching options, and those of all options, fastest first
+
+    .. note::
+
+        Every rollout starts from the initial pose with zero control, the passive settling of the stability
+        test of the GA. The options of a result include the resolved Jacobian and can be passed to `Tensegrity`
+        as they are. `speed` is simulated seconds per wall-clock second. Options diverging, e.g. because of
+        `mjWARN_BADQACC`, never match. Designs resting on slack cables are chaotic, so a small `tol` may only
+        match the reference, which is always among the results.
+
+    """
+    if grid is None:
+        grid = default_grid()
+    model_cache = TopologyModelCache()
+    times = np.arange(0, duration + interval / 2, interval)
+
+    def run(variant):
+        model = variant.create_model(model_cache)
+        positions, elapsed, diverged = _rollout(model, times, repeats)
+        options = {name: variant.options[name] for name in TUNED_OPTIONS}
+        options["jacobian"] = variant.size_options()["jacobian"]
+        return options, positions, duration / max(elapsed, 1e-12), diverged
+
+    options, reference, speed, diverged = run(with_options(tensegrity))
+    if diverged:
+        raise ValueError("Reference rollout of %s diverges" % tensegrity.get_name)
+    results = [TuningResult(options, 0., speed, True)]
+
+    for config in grid:
+        options, positions, speed, diverged = run(with_options(tensegrity, **config))
+        if options == results[0].options:
+            continue
+        error = np.inf if diverged else float(np.linalg.norm(positions - reference, axis=2).max())
+        results.append(TuningResult(options, error, speed, error <= tol))
+
+    results.sort(key=lambda result: -result.speed)
+    best = next(result for result in results if result.matches)
+    return best, results
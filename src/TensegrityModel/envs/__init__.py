@@ -1 +1,12 @@
-from src.TensegrityModel.envs.tensegrity_gym import TensegEnv
+from src.TensegrityModel.lazy_import import lazy_attributes
+
+__all__ = ["TensegEnv", "TensegVectorEnv", "TensegSharedMemoryVectorEnv"]
+
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "TensegEnv": "src.TensegrityModel.envs.tensegrity_gym",
+    "TensegVectorEnv": "src.TensegrityModel.envs.tensegrity_vector_env",
+    "TensegSharedMemoryVectorEnv": "src.TensegrityModel.envs.tensegrity_shared_memory_env",
+    "tensegrity_gym": "src.TensegrityModel.envs.tensegrity_gym",
+    "tensegrity_vector_env": "src.TensegrityModel.envs.tensegrity_vector_env",
+    "tensegrity_shared_memory_env": "src.TensegrityModel.envs.tensegrity_shared_memory_env",
+})
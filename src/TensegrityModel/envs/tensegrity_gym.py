@@ -1,6 +1,7 @@
 import numpy as np
+import mujoco
 from gymnasium import utils
-from gymnasium.envs.mujoco import MujocoEnv
+from gymnasium.envs.mujoco import MujocoEnv, mujoco_env
 from gymnasium.spaces import Box
 
 
@@ -8,6 +9,8 @@ DEFAULT_CAMERA_CONFIG = {
     "distance": 4.0,
 }
 
+FRAME_SKIP = 5
+
 
 class TensegEnv(MujocoEnv, utils.EzPickle):
 
@@ -17,6 +20,7 @@ class TensegEnv(MujocoEnv, utils.EzPickle):
             "rgb_array",
             "depth_array"
         ],
+        # of the default timestep, every instance has the frame rate of its own timestep
         "render_fps": 100
     }
 
@@ -30,8 +34,28 @@ class TensegEnv(MujocoEnv, utils.EzPickle):
             healthy_z_range=(-.2, 5.0),
             reset_noise_scale=0.05,
             exclude_current_positions_from_obs=True,
+            obs_components=("qpos", "qvel"),
+            obs_dtype=np.float64,
+            reuse_obs_buffer=False,
+            verbose_info=True,
+            recorder=None,
+            record_metadata=None,
+            compiled_cache=None,
             **kwargs,
     ):
+        """
+        Args:
+            xml_file: name of the xml file in Gymnasium assets or absolute path, or compiled `mujoco.MjModel`
+            bar_num: number of bars
+            obs_components: parts of the state in observations, in order, from "qpos" and "qvel"
+            obs_dtype: dtype of observations, e.g. np.float32
+            reuse_obs_buffer: True to return the same observation buffer from every step and reset,
+            which is overwritten in place, instead of a new array
+            verbose_info: False to return an empty `info` from `step`
+            recorder: `TrajectoryRecorder` recording every episode from reset to the next reset or close
+            record_metadata: dict stored with every recorded episode in the index of the recorder
+            compiled_cache: `CompiledModelCache` an xml file is loaded from, if compiled before
+        """
         utils.EzPickle.__init__(
             self,
             xml_file,
@@ -42,11 +66,31 @@ class TensegEnv(MujocoEnv, utils.EzPickle):
             healthy_z_range,
             reset_noise_scale,
             exclude_current_positions_from_obs,
+            obs_components,
+            obs_dtype,
+            reuse_obs_buffer,
+            verbose_info,
+            recorder,
+            record_metadata,
+            compiled_cache,
             **kwargs,
         )
 
         self._bar_num = bar_num
 
+        # `xml_file` may also be a compiled model, e.g. from `Tensegrity.create_model`
+        if isinstance(xml_file, mujoco.MjModel):
+            self._model = xml_file
+            # MujocoEnv insists on an existing path, which is never parsed for a compiled model
+            model_path = __file__
+        elif compiled_cache is not None:
+            # resolved like MujocoEnv does
+            model_path = mujoco_env.expand_model_path(xml_file)
+            self._model = compiled_cache.model_from_path(model_path)
+        else:
+            self._model = None
+            model_path = xml_file
+
         self._ctrl_cost_weight = ctrl_cost_weight
 
         self._healthy_reward = healthy_reward
@@ -59,28 +103,59 @@ class TensegEnv(MujocoEnv, utils.EzPickle):
             exclude_current_positions_from_obs
         )
 
-        # Observation Space
-        obs_shape = (7 + 6) * self._bar_num
-        if exclude_current_positions_from_obs:
-            obs_shape -= 2
+        self._obs_components = tuple(obs_components)
+        self._reuse_obs_buffer = reuse_obs_buffer
+        self._verbose_info = verbose_info
+        self._recorder = recorder
+        self._record_metadata = record_metadata if record_metadata is not None else {}
 
-        observation_space = Box(low=-np.inf, high=np.inf, shape=(obs_shape,), dtype=np.float64)
+        # Observation Space
+        obs_shape = 0
+        for component in self._obs_components:
+            if component == "qpos":
+                obs_shape += 7 * self._bar_num
+                if exclude_current_positions_from_obs:
+                    obs_shape -= 2
+            elif component == "qvel":
+                obs_shape += 6 * self._bar_num
+            else:
+                raise ValueError(f"Unknown observation component {component}, expected 'qpos' or 'qvel'")
+
+        observation_space = Box(low=-np.inf, high=np.inf, shape=(obs_shape,), dtype=obs_dtype)
+        self._obs_buffer = np.zeros(obs_shape, dtype=obs_dtype)
 
         # Mujoco Env
         MujocoEnv.__init__(
             self,
-            xml_file,
-            5,
+            model_path,
+            FRAME_SKIP,
             observation_space=observation_space,
             default_camera_config=DEFAULT_CAMERA_CONFIG,
             **kwargs,
         )
 
+        self._bar1 = self.model.body("bar1").id
+
+    def _initialize_simulation(self):
+        if self._model is None:
+            # older versions of gymnasium set the model and data instead of returning them
+            simulation = super()._initialize_simulation()
+            if simulation is not None:
+                self.model, self.data = simulation
+        else:
+            self.model = self._model
+            self.model.vis.global_.offwidth = self.width
+            self.model.vis.global_.offheight = self.height
+            self.data = mujoco.MjData(self.model)
+        # MujocoEnv checks the frame rate against the timestep of the model
+        self.metadata = dict(self.metadata, render_fps=int(np.round(1.0 / (self.model.opt.timestep * FRAME_SKIP))))
+        return self.model, self.data
+
     @property
     def is_healthy(self):
-        state = self.state_vector()
+        qpos, qvel = self.data.qpos, self.data.qvel
         min_z, max_z = self._healthy_z_range
-        is_healthy = np.isfinite(state).all() and min_z <= state[2] <= max_z
+        is_healthy = np.isfinite(qpos).all() and np.isfinite(qvel).all() and min_z <= qpos[2] <= max_z
         return is_healthy
 
     @property
@@ -97,24 +172,30 @@ class TensegEnv(MujocoEnv, utils.EzPickle):
         return terminated
 
     def _get_obs(self):
-        position = self.data.qpos.flat.copy()
-        velocity = self.data.qvel.flat.copy()
-
-        if self._exclude_current_positions_from_obs:
-            position = position[2:]
+        start = 0
+        for component in self._obs_components:
+            if component == "qpos":
+                values = self.data.qpos[2:] if self._exclude_current_positions_from_obs else self.data.qpos
+            else:
+                values = self.data.qvel
+            self._obs_buffer[start:start + len(values)] = values
+            start += len(values)
 
-        return np.concatenate((position, velocity))
+        return self._obs_buffer if self._reuse_obs_buffer else self._obs_buffer.copy()
 
     def step(self, action):
-        xy_position_before = self.get_body_com("bar1")[:2].copy()
+        xy_position_before = self.data.xpos[self._bar1, :2].copy()
         self.do_simulation(action, self.frame_skip)
-        xy_position_after = self.get_body_com("bar1")[:2].copy()
+        xy_position_after = self.data.xpos[self._bar1, :2].copy()
 
         xy_velocity = (xy_position_after - xy_position_before) / self.dt
         x_velocity, y_velocity = xy_velocity
 
+        # health is checked once per step
+        is_healthy = self.is_healthy
+
         forward_reward = x_velocity
-        healthy_reward = self.healthy_reward
+        healthy_reward = (is_healthy or self._terminate_when_unhealthy) * self._healthy_reward
 
         rewards = forward_reward + healthy_reward
 
@@ -122,20 +203,26 @@ class TensegEnv(MujocoEnv, utils.EzPickle):
 
         reward = rewards - costs
 
-        terminated = self.terminated
+        terminated = not is_healthy if self._terminate_when_unhealthy else False
 
         observation = self._get_obs()
 
-        info = {
-            "reward_forward": forward_reward,
-            "reward_ctrl": -ctrl_cost,
-            "reward_health": healthy_reward,
-            "x_position": xy_position_after[0],
-            "y_position": xy_position_after[1],
-            "distance_from_origin": np.linalg.norm(xy_position_after, ord=2),
-            "x_velocity": x_velocity,
-            "y_velocity": y_velocity,
-        }
+        if self._recorder is not None:
+            self._recorder.record(self.data)
+
+        if self._verbose_info:
+            info = {
+                "reward_forward": forward_reward,
+                "reward_ctrl": -ctrl_cost,
+                "reward_health": healthy_reward,
+                "x_position": xy_position_after[0],
+                "y_position": xy_position_after[1],
+                "distance_from_origin": np.linalg.norm(xy_position_after, ord=2),
+                "x_velocity": x_velocity,
+                "y_velocity": y_velocity,
+            }
+        else:
+            info = {}
 
         if self.render_mode == "human":
             self.render()
@@ -150,6 +237,15 @@ class TensegEnv(MujocoEnv, utils.EzPickle):
         qvel = (self.init_qvel + self._reset_noise_scale * self.np_random.standard_normal(self.model.nv))
         self.set_state(qpos, qvel)
 
+        if self._recorder is not None:
+            self._recorder.begin_episode(**self._record_metadata)
+            self._recorder.record(self.data)
+
         observation = self._get_obs()
 
         return observation
+
+    def close(self):
+        if self._recorder is not None:
+            self._recorder.end_episode()
+        super().close()
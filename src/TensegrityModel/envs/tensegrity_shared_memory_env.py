@@ -0,0 +1,215 @@
+import os
+import traceback
+import multiprocessing as mp
+import numpy as np
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+from src.TensegrityModel.envs.tensegrity_gym import TensegEnv
+from src.TensegrityModel.envs.tensegrity_vector_env import AutoresetMode, add_final_info
+
+# step info of `TensegEnv`, one column of the shared info array each
+INFO_KEYS = ("reward_forward", "reward_ctrl", "reward_health", "x_position", "y_position", "distance_from_origin",
+             "x_velocity", "y_velocity")
+
+
+def _shared_array(ctx, shape, dtype):
+    """Allocate a shared buffer and return it with a numpy view on it"""
+    buffer = ctx.RawArray(np.ctypeslib.as_ctypes_type(dtype), int(np.prod(shape)))
+    return buffer, _as_array(buffer, shape, dtype)
+
+
+def _as_array(buffer, shape, dtype):
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def _worker(remote, parent_remote, xml_file, bar_num, env_kwargs, start, stop, max_episode_steps, buffers, shapes):
+    """Step envs `start` to `stop`, reading actions from and writing results to the shared buffers"""
+    parent_remote.close()
+    observations, final_observations, actions, rewards, terminated, truncated, infos = (
+        _as_array(buffer, shape, dtype) for buffer, (shape, dtype) in zip(buffers, shapes)
+    )
+    envs = [TensegEnv(xml_file, bar_num, **env_kwargs) for _ in range(start, stop)]
+    elapsed_steps = np.zeros(len(envs), dtype=int)
+
+    try:
+        while True:
+            command, seed = remote.recv()
+            if command == "step":
+                for j, env in enumerate(envs):
+                    i = start + j
+                    observation, reward, terminated[i], _, info = env.step(actions[i])
+                    elapsed_steps[j] += 1
+                    truncated[i] = elapsed_steps[j] >= max_episode_steps
+                    rewards[i] = reward
+                    # empty with `verbose_info=False`
+                    if info:
+                        infos[i] = [info[key] for key in INFO_KEYS]
+                    if terminated[i] or truncated[i]:
+                        final_observations[i] = observation
+                        observation, _ = env.reset()
+                        elapsed_steps[j] = 0
+                    observations[i] = observation
+            elif command == "reset":
+                for j, env in enumerate(envs):
+                    observations[start + j], _ = env.reset(seed=None if seed is None else seed + start + j)
+                    elapsed_steps[j] = 0
+            elif command == "close":
+                break
+            # the only message per batch step, results are already in shared memory
+            remote.send(None)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        remote.send(traceback.format_exc())
+    finally:
+        for env in envs:
+            env.close()
+        remote.close()
+
+
+class TensegSharedMemoryVectorEnv(VectorEnv):
+    """
+    .. note::
+
+        Vectorized `TensegEnv` over worker processes. Each worker steps a contiguous range of environments
+        and writes observations, rewards, flags and step info straight into shared-memory arrays, and actions
+        are read from shared memory as well. Only a small command and an acknowledgement go through the pipes
+        per batch step, so nothing is pickled.
+
+        Follows the Gymnasium vector API with same-step autoreset, like `TensegVectorEnv`: `step` returns the
+        info of every env batched by key, empty with `verbose_info=False`. Finished envs are reset within
+        `step`, and their last observation and info are returned in `info["final_obs"]` and
+        `info["final_info"]`, masked by `info["_final_obs"]` and `info["_final_info"]`, or in
+        `info["final_observation"]` with Gymnasium before 1.0.
+
+    """
+
+    metadata = {"render_modes": []}
+    if AutoresetMode is not None:
+        metadata["autoreset_mode"] = AutoresetMode.SAME_STEP
+
+    def __init__(
+            self,
+            xml_file,
+            bar_num,
+            num_envs,
+            n_workers=None,
+            max_episode_steps=1000,
+            context=None,
+            copy=True,
+            **kwargs,
+    ):
+        """
+        Args:
+            xml_file: name of the xml file or compiled `mujoco.MjModel`, as in `TensegEnv`
+            bar_num: number of bars
+            num_envs: number of environments
+            n_workers: number of worker processes. defaults to one per core
+            max_episode_steps: episodes are truncated after this number of steps
+            context: multiprocessing start method. defaults to the platform default
+            copy: False to return the shared observation buffer, which is overwritten by the next step
+            **kwargs: keyword arguments passed to every `TensegEnv`,
+            e.g. `reset_noise_scale`, `exclude_current_positions_from_obs`
+        """
+        # spaces come from a probe env, so they follow the env options
+        probe = TensegEnv(xml_file, bar_num, **kwargs)
+        self.single_observation_space = probe.observation_space
+        self.single_action_space = probe.action_space
+        probe.close()
+        self._verbose_info = kwargs.get("verbose_info", True)
+
+        self.num_envs = num_envs
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.is_vector_env = True
+        self.closed = False
+        self._copy = copy
+
+        ctx = mp.get_context(context)
+        obs_shape = (num_envs,) + self.single_observation_space.shape
+        act_shape = (num_envs,) + self.single_action_space.shape
+        shapes = [
+            (obs_shape, self.single_observation_space.dtype),
+            (obs_shape, self.single_observation_space.dtype),
+            (act_shape, self.single_action_space.dtype),
+            ((num_envs,), np.float64),
+            ((num_envs,), np.bool_),
+            ((num_envs,), np.bool_),
+            ((num_envs, len(INFO_KEYS)), np.float64),
+        ]
+        buffers = []
+        arrays = []
+        for shape, dtype in shapes:
+            buffer, array = _shared_array(ctx, shape, dtype)
+            buffers.append(buffer)
+            arrays.append(array)
+        (self._observations, self._final_observations, self._actions,
+         self._rewards, self._terminated, self._truncated, self._infos) = arrays
+
+        n_workers = min(n_workers or os.cpu_count() or 1, num_envs)
+        bounds = np.linspace(0, num_envs, n_workers + 1).astype(int)
+        self._remotes = []
+        self._processes = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent_remote, child_remote = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                name="TensegWorker-%d" % len(self._processes),
+                args=(child_remote, parent_remote, xml_file, bar_num, kwargs,
+                      int(start), int(stop), max_episode_steps, buffers, shapes),
+                daemon=True,
+            )
+            process.start()
+            child_remote.close()
+            self._remotes.append(parent_remote)
+            self._processes.append(process)
+
+    def _command(self, command, seed=None):
+        """Send a command to every worker and wait until all of them are done"""
+        for remote in self._remotes:
+            remote.send((command, seed))
+        errors = []
+        for remote, process in zip(self._remotes, self._processes):
+            while not remote.poll(1):
+                if not process.is_alive():
+                    raise RuntimeError("%s exited unexpectedly" % process.name)
+            error = remote.recv()
+            if error is not None:
+                errors.append("%s:\n%s" % (process.name, error))
+        if errors:
+            raise RuntimeError("\n".join(errors))
+
+    def _get_obs(self):
+        return self._observations.copy() if self._copy else self._observations
+
+    def reset(self, *, seed=None, options=None):
+        self._command("reset", seed)
+        return self._get_obs(), {}
+
+    def step(self, actions):
+        np.copyto(self._actions, actions)
+        self._command("step")
+
+        terminated = self._terminated.copy()
+        truncated = self._truncated.copy()
+        info = {key: self._infos[:, k].copy() for k, key in enumerate(INFO_KEYS)} if self._verbose_info else {}
+        done = terminated | truncated
+        if done.any():
+            final_observations = np.full(self.num_envs, None, dtype=object)
+            for i in np.flatnonzero(done):
+                final_observations[i] = self._final_observations[i].copy()
+            # the info of a finished env is that of its last step, written before the reset
+            add_final_info(info, done, final_observations, info.copy())
+
+        return self._get_obs(), self._rewards.copy(), terminated, truncated, info
+
+    def close_extras(self, **kwargs):
+        for remote in self._remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self._processes:
+            process.join()
+        for remote in self._remotes:
+            remote.close()
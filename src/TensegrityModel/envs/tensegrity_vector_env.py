@@ -0,0 +1,248 @@
+import os
+from concurrent import futures
+import numpy as np
+import mujoco
+from gymnasium.spaces import Box
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+
+try:
+    from gymnasium.vector import AutoresetMode
+except ImportError:
+    # Gymnasium < 1.0, where vector envs always reset finished envs within `step`
+    AutoresetMode = None
+
+
+def add_final_info(info, done, final_observations, final_info):
+    """
+    Report the envs reset within a vectorized `step` the way the installed Gymnasium does
+    Args:
+        info: info dict of the step, updated in place
+        done: boolean mask of the finished envs
+        final_observations: object array of the last observation of each finished env, None for the others
+        final_info: dict of the last info of the envs, one array over all envs per key
+    """
+    if AutoresetMode is not None:
+        # batched like the `final_info` of `SyncVectorEnv` with `AutoresetMode.SAME_STEP`
+        info["final_obs"] = final_observations
+        info["final_info"] = {}
+        for key, value in final_info.items():
+            info["final_info"][key] = np.where(done.reshape((-1,) + (1,) * (np.ndim(value) - 1)), value, 0)
+            info["final_info"]["_" + key] = done.copy()
+        info["_final_obs"] = info["_final_info"] = done.copy()
+    else:
+        info["final_observation"] = final_observations
+        info["final_info"] = np.full(len(done), None, dtype=object)
+        for i in np.flatnonzero(done):
+            info["final_info"][i] = {key: value[i] for key, value in final_info.items()}
+        info["_final_observation"] = info["_final_info"] = done.copy()
+
+
+class TensegVectorEnv(VectorEnv):
+    """
+    .. note::
+
+        Vectorized `TensegEnv` in one process: `num_envs` MjData share one compiled MjModel and are stepped
+        by a pool of threads, since `mj_step` releases the GIL. Observations, rewards and flags are written
+        into preallocated batch arrays. Rewards, termination and observations are the same as `TensegEnv`
+        wrapped in a `TimeLimit` of `max_episode_steps`.
+
+        Follows the Gymnasium vector API with same-step autoreset: finished envs are reset within `step`, and
+        their last observation and info are returned in `info["final_obs"]` and `info["final_info"]`, masked
+        by `info["_final_obs"]` and `info["_final_info"]`, or in `info["final_observation"]` with Gymnasium
+        before 1.0.
+
+    """
+
+    metadata = {"render_modes": []}
+    if AutoresetMode is not None:
+        metadata["autoreset_mode"] = AutoresetMode.SAME_STEP
+
+    def __init__(
+            self,
+            xml_file,
+            bar_num,
+            num_envs,
+            n_threads=None,
+            frame_skip=5,
+            max_episode_steps=1000,
+            ctrl_cost_weight=0.05,
+            healthy_reward=1.0,
+            terminate_when_unhealthy=True,
+            healthy_z_range=(-.2, 5.0),
+            reset_noise_scale=0.05,
+            exclude_current_positions_from_obs=True,
+            obs_components=("qpos", "qvel"),
+            obs_dtype=np.float64,
+            copy=True,
+    ):
+        """
+        Args:
+            xml_file: compiled `mujoco.MjModel`, or path of the xml file
+            bar_num: number of bars
+            num_envs: number of environments
+            n_threads: number of threads stepping the environments. defaults to one per core
+            frame_skip: number of Mujoco steps per env step
+            max_episode_steps: episodes are truncated after this number of steps
+            copy: False to return the internal observation buffer, which is overwritten by the next step
+            other args: the same as `TensegEnv`, e.g. `obs_components` and `obs_dtype`
+        """
+        if isinstance(xml_file, mujoco.MjModel):
+            self.model = xml_file
+        else:
+            self.model = mujoco.MjModel.from_xml_path(xml_file)
+        self.data = [mujoco.MjData(self.model) for _ in range(num_envs)]
+
+        self._bar_num = bar_num
+        self._frame_skip = frame_skip
+        self._max_episode_steps = max_episode_steps
+
+        self._ctrl_cost_weight = ctrl_cost_weight
+        self._healthy_reward = healthy_reward
+        self._terminate_when_unhealthy = terminate_when_unhealthy
+        self._healthy_z_range = healthy_z_range
+        self._reset_noise_scale = reset_noise_scale
+        self._exclude_current_positions_from_obs = exclude_current_positions_from_obs
+        self._copy = copy
+
+        self._init_qpos = self.model.qpos0.copy()
+        self._init_qvel = np.zeros(self.model.nv)
+        self._bar1 = self.model.body("bar1").id
+
+        # Spaces, observations are columns `_obs_index` of the state (qpos, qvel)
+        nq, nv = self.model.nq, self.model.nv
+        obs_index = []
+        for component in obs_components:
+            if component == "qpos":
+                obs_index.append(np.arange(2 if exclude_current_positions_from_obs else 0, nq))
+            elif component == "qvel":
+                obs_index.append(np.arange(nq, nq + nv))
+            else:
+                raise ValueError(f"Unknown observation component {component}, expected 'qpos' or 'qvel'")
+        self._obs_index = np.concatenate(obs_index)
+        obs_shape = len(self._obs_index)
+
+        self.num_envs = num_envs
+        self.single_observation_space = Box(low=-np.inf, high=np.inf, shape=(obs_shape,), dtype=obs_dtype)
+        bounds = self.model.actuator_ctrlrange.copy().astype(np.float32)
+        self.single_action_space = Box(low=bounds[:, 0], high=bounds[:, 1], dtype=np.float32)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.is_vector_env = True
+        self.closed = False
+
+        # Batch buffers
+        self._state = np.zeros((num_envs, nq + nv))
+        self._observations = np.zeros((num_envs, obs_shape), dtype=obs_dtype)
+        self._actions = np.zeros((num_envs, self.model.nu))
+        self._xy_before = np.zeros((num_envs, 2))
+        self._xy_after = np.zeros((num_envs, 2))
+        self._elapsed_steps = np.zeros(num_envs, dtype=int)
+        self._np_random = np.random.default_rng()
+
+        # Threads, each steps a contiguous range of environments
+        n_threads = min(n_threads or os.cpu_count() or 1, num_envs)
+        bounds = np.linspace(0, num_envs, n_threads + 1).astype(int)
+        self._ranges = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        self._pool = futures.ThreadPoolExecutor(max_workers=len(self._ranges)) if len(self._ranges) > 1 else None
+
+    @property
+    def dt(self):
+        return self.model.opt.timestep * self._frame_skip
+
+    def _run(self, fn):
+        if self._pool is None:
+            fn(0, self.num_envs)
+        else:
+            for task in [self._pool.submit(fn, start, stop) for start, stop in self._ranges]:
+                task.result()
+
+    def _step_range(self, start, stop):
+        model, nq = self.model, self.model.nq
+        for i in range(start, stop):
+            data = self.data[i]
+            self._xy_before[i] = data.xpos[self._bar1, :2]
+            data.ctrl[:] = self._actions[i]
+            mujoco.mj_step(model, data, nstep=self._frame_skip)
+            mujoco.mj_rnePostConstraint(model, data)
+            self._xy_after[i] = data.xpos[self._bar1, :2]
+            self._state[i, :nq] = data.qpos
+            self._state[i, nq:] = data.qvel
+
+    def _reset_env(self, i):
+        model, data, nq = self.model, self.data[i], self.model.nq
+        mujoco.mj_resetData(model, data)
+
+        noise_low = -self._reset_noise_scale
+        noise_high = self._reset_noise_scale
+        data.qpos[:] = self._init_qpos + self._np_random.uniform(low=noise_low, high=noise_high, size=model.nq)
+        data.qvel[:] = self._init_qvel + self._reset_noise_scale * self._np_random.standard_normal(model.nv)
+        if model.na == 0:
+            data.act[:] = None
+        mujoco.mj_forward(model, data)
+
+        self._state[i, :nq] = data.qpos
+        self._state[i, nq:] = data.qvel
+        self._elapsed_steps[i] = 0
+
+    def _get_obs(self):
+        self._observations[:] = self._state[:, self._obs_index]
+        return self._observations.copy() if self._copy else self._observations
+
+    def reset(self, *, seed=None, options=None):
+        if seed is not None:
+            self._np_random = np.random.default_rng(seed)
+        for i in range(self.num_envs):
+            self._reset_env(i)
+        return self._get_obs(), {}
+
+    def step(self, actions):
+        np.copyto(self._actions, actions)
+        self._run(self._step_range)
+
+        xy_velocity = (self._xy_after - self._xy_before) / self.dt
+        x_velocity, y_velocity = xy_velocity[:, 0], xy_velocity[:, 1]
+
+        min_z, max_z = self._healthy_z_range
+        z = self._state[:, 2]
+        is_healthy = np.isfinite(self._state).all(axis=1) & (min_z <= z) & (z <= max_z)
+
+        forward_reward = x_velocity
+        healthy_reward = (is_healthy | self._terminate_when_unhealthy) * self._healthy_reward
+        ctrl_cost = self._ctrl_cost_weight * np.sum(np.square(self._actions), axis=1)
+        rewards = forward_reward + healthy_reward - ctrl_cost
+
+        if self._terminate_when_unhealthy:
+            terminated = ~is_healthy
+        else:
+            terminated = np.zeros(self.num_envs, dtype=bool)
+        self._elapsed_steps += 1
+        truncated = self._elapsed_steps >= self._max_episode_steps
+
+        observations = self._get_obs()
+        info = {
+            "reward_forward": forward_reward,
+            "reward_ctrl": -ctrl_cost,
+            "reward_health": healthy_reward,
+            "x_position": self._xy_after[:, 0].copy(),
+            "y_position": self._xy_after[:, 1].copy(),
+            "distance_from_origin": np.linalg.norm(self._xy_after, ord=2, axis=1),
+            "x_velocity": x_velocity,
+            "y_velocity": y_velocity,
+        }
+
+        done = terminated | truncated
+        if done.any():
+            final_observations = np.full(self.num_envs, None, dtype=object)
+            for i in np.flatnonzero(done):
+                final_observations[i] = observations[i].copy()
+                self._reset_env(i)
+                observations[i] = self._state[i, self._obs_index]
+            add_final_info(info, done, final_observations, info.copy())
+
+        return observations, rewards, terminated, truncated, info
+
+    def close_extras(self, **kwargs):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,36 @@
+import importlib
+
+
+def lazy_attributes(package, attributes):
+    """
+    Module `__getattr__` and `__dir__` of a package whose public names are imported on first use (PEP 562)
+    Args:
+        package: `__name__` of the package
+        attributes: dict of each public name to the module defining it, or of a submodule to
+            itself
+
+    Returns: `__getattr__` and `__dir__` functions for the namespace of the package
+
+    .. note::
+
+        An attribute is imported the first time it is looked up, e.g. by `from package import name`, and then
+        stored in the namespace of the package, so later lookups are plain ones. Importing the package itself
+        imports none of its modules, so that scripts and worker processes only pay for what they use.
+
+    """
+    namespace = importlib.import_module(package).__dict__
+
+    def __getattr__(name):
+        if name not in attributes:
+            raise AttributeError("module %r has no attribute %r" % (package, name))
+        module = attributes[name]
+        value = importlib.import_module(module)
+        if module.rpartition(".")[2] != name:
+            value = getattr(value, name)
+        namespace[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(namespace) | set(attributes))
+
+    return __getattr__, __dir__
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import tempfile
+import mujoco
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks, e.g. on Windows, where eviction is not serialized between processes
+    fcntl = None
+
+LOCK_FILE = ".lock"
+
+
+class CompiledModelCache(object):
+    """
+    Compiled models on local disk, addressed by a hash of their MJCF, shared by processes and runs
+
+    .. note::
+
+        A model is stored as a MuJoCo binary (MJB) file named by the SHA-256 of its MJCF text and of the MuJoCo
+        version, since binaries are not portable between versions. Files are written to a temporary file and
+        renamed, so readers never see a partial model, and a reader racing with eviction compiles the model
+        again. Files are touched when read, and the least recently used ones are deleted once the directory
+        exceeds `max_bytes`, under an exclusive `fcntl` lock. Only the MJCF text is hashed, so a model must not
+        include other files.
+
+        A binary of the default scene takes about 12 MB, mostly its 800 x 800 skybox texture, so the default
+        `max_bytes` holds about 85 models, and a miss, which compiles and writes the binary, costs more than a
+        plain compile.
+
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        """
+        Args:
+            directory: directory of the binaries, created if needed
+            max_bytes: max total size of the binaries, default 1 GiB
+        """
+        self._directory = os.path.expanduser(directory)
+        self._max_bytes = max_bytes
+        os.makedirs(self._directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "CompiledModelCache(%r, %r)" % (self._directory, self._max_bytes)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @staticmethod
+    def key(xml):
+        """Hash of an MJCF text for the installed MuJoCo"""
+        return hashlib.sha256((mujoco.__version__ + "\0" + xml).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key + ".mjb")
+
+    def get(self, xml):
+        """Compiled model of an MJCF text, or None if it is not in the cache"""
+        path = self._path(self.key(xml))
+        # MuJoCo prints a warning for a missing file
+        if not os.path.exists(path):
+            return None
+        try:
+            model = mujoco.MjModel.from_binary_path(path)
+            os.utime(path)
+        except (ValueError, OSError):
+            # evicted meanwhile
+            return None
+        return model
+
+    def put(self, xml, model):
+        """Store the compiled model of an MJCF text"""
+        path = self._path(self.key(xml))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            mujoco.mj_saveModel(model, temp_path, None)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def model(self, xml):
+        """
+        Compiled model of an MJCF text, compiled and stored if it is not in the cache
+        Args:
+            xml: MJCF text, e.g. of `Tensegrity.to_xml_string`
+
+        Returns: `mujoco.MjModel`
+
+        """
+        model = self.get(xml)
+        if model is not None:
+            self.hits += 1
+            return model
+        self.misses += 1
+        model = mujoco.MjModel.from_xml_string(xml)
+        self.put(xml, model)
+        return model
+
+    def model_from_path(self, path):
+        """Compiled model of an MJCF file, see `model`"""
+        with open(path) as f:
+            return self.model(f.read())
+
+    def _entries(self):
+        entries = []
+        for shard in os.scandir(self._directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".mjb"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Delete the least recently used binaries beyond `max_bytes`"""
+        with open(os.path.join(self._directory, LOCK_FILE), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self._max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def __len__(self):
+        return len(self._entries())
+
+    def size(self):
+        """Total size in bytes of the binaries"""
+        return sum(size for _, size, _ in self._entries())
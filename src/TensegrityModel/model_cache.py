@@ -0,0 +1,149 @@
+import copy
+import threading
+from collections import OrderedDict
+import numpy as np
+import mujoco
+
+
+def _z_to_vec_quat(vectors):
+    """Quaternions rotating the z axis onto each of the (unit) vectors, as the MJCF compiler does for `fromto`"""
+    axis = np.stack((-vectors[:, 1], vectors[:, 0], np.zeros(len(vectors))), axis=1)
+    s = np.linalg.norm(axis, axis=1)
+    axis = np.divide(axis, s[:, np.newaxis], out=np.tile([1., 0., 0.], (len(vectors), 1)),
+                     where=s[:, np.newaxis] >= 1e-10)
+    angle = np.arctan2(s, vectors[:, 2])
+    return np.column_stack((np.cos(angle / 2), axis * np.sin(angle / 2)[:, np.newaxis]))
+
+
+def _capsule_inertia(mass, radius, half_length):
+    """Principal moments of solid capsules along their axis z, as computed by the MJCF compiler"""
+    height = 2 * half_length
+    sphere_mass = mass * 4 * radius / (4 * radius + 3 * height)
+    cylinder_mass = mass - sphere_mass
+    sphere_inertia = 2 * sphere_mass * radius * radius / 5
+    transverse = (cylinder_mass * (3 * radius * radius + height * height) / 12
+                  + sphere_inertia + sphere_mass * height * (3 * radius + 2 * height) / 8)
+    axial = cylinder_mass * radius * radius / 2 + sphere_inertia
+    return np.column_stack((transverse, transverse, axial))
+
+
+def update_geometry(model, nodes, bars, cables, data=None):
+    """
+    Move the nodes of a compiled tensegrity in place, as if it was compiled with the new nodes
+    Args:
+        model: `mujoco.MjModel` built by `Tensegrity` with the same bars, cables and options
+        nodes: new coordinates of nodes
+        bars: pairs of bars
+        cables: pairs of cables
+        data: `mujoco.MjData` of the model used as scratch space by `mj_setConst`. defaults to a new one
+
+    .. note::
+
+        Bars are capsules from node to node in bodies at the origin, with their inertial frame at the capsule.
+        Their pose, length, bounding volumes and inertia are rewritten, as well as the sites at nodes and the
+        slack length of tendons, then `mj_setConst` recomputes the constants derived from them.
+
+    """
+    nodes = np.asarray(nodes, dtype=float)
+    bars = np.asarray(bars, dtype=int)
+    cables = np.asarray(cables, dtype=int)
+    bar_ids = np.asarray([model.geom("bar%d" % (i + 1)).id for i in range(len(bars))])
+    body_ids = model.geom_bodyid[bar_ids]
+
+    start, end = nodes[bars[:, 0]], nodes[bars[:, 1]]
+    axis = end - start
+    length = np.linalg.norm(axis, axis=1)
+    center = (start + end) / 2
+    quat = _z_to_vec_quat(axis / length[:, np.newaxis])
+    radius = model.geom_size[bar_ids, 0]
+    half_length = length / 2
+
+    model.geom_pos[bar_ids] = center
+    model.geom_quat[bar_ids] = quat
+    model.geom_size[bar_ids, 1] = half_length
+    model.geom_rbound[bar_ids] = half_length + radius
+    model.geom_aabb[bar_ids] = np.column_stack((np.zeros((len(bars), 3)), radius, radius, half_length + radius))
+    model.body_ipos[body_ids] = center
+    model.body_iquat[body_ids] = quat
+    model.body_inertia[body_ids] = _capsule_inertia(model.body_mass[body_ids], radius, half_length)
+    if hasattr(model, "bvh_aabb"):
+        # one geom per body, so the bounding volume of the body is the one of its capsule
+        model.bvh_aabb[model.body_bvhadr[body_ids]] = model.geom_aabb[bar_ids]
+
+    for i, (node1, node2) in enumerate(bars):
+        model.site_pos[model.site("b%d" % node1).id] = nodes[node1]
+        model.site_pos[model.site("b%d" % node2).id] = nodes[node2]
+    model.tendon_lengthspring[:len(cables), 1] = np.linalg.norm(nodes[cables[:, 0]] - nodes[cables[:, 1]], axis=1)
+
+    mujoco.mj_setConst(model, data if data is not None else mujoco.MjData(model))
+
+
+class TopologyModelCache(object):
+    """
+    Compiled models of tensegrities by topology, so that designs differing only in node coordinates
+    are never compiled again
+
+    .. note::
+
+        A design is looked up by its name, bars, cables, actuators and the options of cables and motors. The
+        first design of a topology is compiled from its MJCF, later ones get a copy of that model with the
+        geometry rewritten by `update_geometry` and the simulation options (timestep, solver iterations,
+        integrator, solver and Jacobian) by `Tensegrity.set_options`, which skips the XML parser and compiler. The
+        first model is kept by the cache as the template of its topology, so it must not be modified. Least
+        recently used topologies are dropped beyond `maxsize`. A cache is safe to share between threads, and is
+        pickled empty.
+
+    """
+
+    def __init__(self, maxsize=64):
+        """
+        Args:
+            maxsize: max number of compiled topologies kept
+        """
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return {"maxsize": self._maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def model(self, tensegrity, compiled_cache=None):
+        """
+        Compiled model of a tensegrity
+        Args:
+            tensegrity: `Tensegrity`
+            compiled_cache: `CompiledModelCache` the first design of a topology is loaded from, if compiled before
+
+        Returns: `mujoco.MjModel` of the tensegrity
+
+        """
+        key = tensegrity.topology_key()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            model = tensegrity.create_model(compiled_cache=compiled_cache)
+            with self._lock:
+                # simulation only reads the model, so it can be copied from while in use
+                self._entries[key] = model
+                if len(self._entries) > self._maxsize:
+                    self._entries.popitem(last=False)
+            return model
+
+        model = copy.copy(entry)
+        update_geometry(model, tensegrity.nodes, tensegrity.bars, tensegrity.cables)
+        tensegrity.set_options(model)
+        return model
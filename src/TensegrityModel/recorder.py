@@ -0,0 +1,177 @@
+import json
+import os
+import numpy as np
+
+INDEX_FILE = "index.jsonl"
+META_FILE = "meta.json"
+
+
+class TrajectoryRecorder(object):
+    """
+    Streaming recorder of rollouts, writing states to memory-mapped chunks as they are stepped
+
+    .. note::
+
+        Every field (an attribute of `mujoco.MjData`, e.g. `qpos`, `qvel`, `ctrl`) is stored in `.npy` chunks of
+        `chunk_size` rows, `<field>-<chunk>.npy`, which are memory-mapped while written so that nothing is
+        kept in memory. Rows of all episodes follow each other, and `index.jsonl` has a line per finished episode
+        with its first row, its length and any metadata, e.g. the design it belongs to. Use `TrajectoryReader`
+        to load slices of episodes.
+
+    """
+
+    def __init__(self, directory, fields=("time", "qpos", "qvel", "ctrl"), chunk_size=10000, dtype=np.float64):
+        """
+        Args:
+            directory: directory of the recording, created if needed
+            fields: attributes of `mujoco.MjData` recorded at every step
+            chunk_size: number of rows per chunk file
+            dtype: dtype of the stored states
+        """
+        self._directory = directory
+        self._fields = tuple(fields)
+        self._chunk_size = chunk_size
+        self._dtype = np.dtype(dtype)
+
+        os.makedirs(directory, exist_ok=True)
+        self._episode = 0
+        self._rows = 0
+        path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(path):
+            # continue an existing recording after its last finished episode
+            with open(path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._episode = entry["episode"] + 1
+                    self._rows = entry["start"] + entry["length"]
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({"fields": self._fields, "chunk_size": chunk_size, "dtype": self._dtype.str}, f)
+        self._index = open(path, 'a')
+
+        self._chunk = None
+        self._arrays = {}
+        self._start = None
+        self._metadata = None
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _open_chunk(self, chunk, data):
+        self._flush()
+        self._arrays = {}
+        for field in self._fields:
+            shape = (self._chunk_size,) + np.shape(getattr(data, field))
+            path = os.path.join(self._directory, "%s-%06d.npy" % (field, chunk))
+            if os.path.exists(path):
+                self._arrays[field] = np.load(path, mmap_mode='r+')
+            else:
+                self._arrays[field] = np.lib.format.open_memmap(path, mode='w+', dtype=self._dtype, shape=shape)
+        self._chunk = chunk
+
+    def _flush(self):
+        for array in self._arrays.values():
+            array.flush()
+
+    def begin_episode(self, **metadata):
+        """Start a new episode, ending the current one. `metadata` is stored in the index"""
+        if self._start is not None:
+            self.end_episode()
+        self._start = self._rows
+        self._metadata = metadata
+
+    def record(self, data):
+        """Append the state of `mujoco.MjData` to the current episode"""
+        chunk, row = divmod(self._rows, self._chunk_size)
+        if chunk != self._chunk:
+            self._open_chunk(chunk, data)
+        for field, array in self._arrays.items():
+            array[row] = getattr(data, field)
+        self._rows += 1
+
+    def end_episode(self, **metadata):
+        """Finish the current episode, if any, and add it to the index with `metadata`"""
+        if self._start is None:
+            return
+        entry = {"episode": self._episode, "start": self._start, "length": self._rows - self._start}
+        entry.update(self._metadata)
+        entry.update(metadata)
+        self._index.write(json.dumps(entry, default=float) + "\n")
+        self._index.flush()
+        self._episode += 1
+        self._start = None
+
+    def close(self):
+        self.end_episode()
+        self._flush()
+        self._arrays = {}
+        self._chunk = None
+        self._index.close()
+
+
+class TrajectoryReader(object):
+    """
+    Reader of recordings of `TrajectoryRecorder`, in a directory or any of its subdirectories
+
+    .. note::
+
+        `episodes` lists the index entries of all episodes, with the recording they belong to. `load` reads a
+        slice of a field of one episode from the memory-mapped chunks, without reading the rest of the files.
+
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory: directory of a recording, or of several recordings, e.g. of the workers of a GA
+        """
+        self._recordings = {}
+        self.episodes = []
+        for root, _, files in sorted(os.walk(directory)):
+            if INDEX_FILE not in files or META_FILE not in files:
+                continue
+            with open(os.path.join(root, META_FILE)) as f:
+                self._recordings[root] = json.load(f)
+            with open(os.path.join(root, INDEX_FILE)) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    entry["recording"] = root
+                    self.episodes.append(entry)
+        self._chunks = {}
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def _chunk(self, recording, field, chunk):
+        key = (recording, field, chunk)
+        if key not in self._chunks:
+            self._chunks[key] = np.load(os.path.join(recording, "%s-%06d.npy" % (field, chunk)), mmap_mode='r')
+        return self._chunks[key]
+
+    def load(self, episode, field, start=0, stop=None):
+        """
+        Load steps `start` to `stop` of a field of an episode
+        Args:
+            episode: position in `episodes`, or one of its entries
+            field: recorded field, e.g. `qpos`
+            start: first step
+            stop: end step. defaults to the end of the episode
+
+        Returns: array of the field, one row per step
+
+        """
+        entry = self.episodes[episode] if isinstance(episode, (int, np.integer)) else episode
+        chunk_size = self._recordings[entry["recording"]]["chunk_size"]
+        start, stop, _ = slice(start, stop).indices(entry["length"])
+        first, last = entry["start"] + start, entry["start"] + max(stop, start)
+
+        parts = []
+        row = first
+        while row < last:
+            chunk, offset = divmod(row, chunk_size)
+            count = min(chunk_size - offset, last - row)
+            parts.append(self._chunk(entry["recording"], field, chunk)[offset:offset + count])
+            row += count
+        if not parts:
+            return self._chunk(entry["recording"], field, 0)[:0].copy()
+        return np.concatenate(parts)
@@ -1,10 +1,19 @@
 import os.path as osp
 from src.TensegrityModel.scene import create_scene
-from gymnasium.envs.registration import register
-import subprocess
+import tempfile
 import os
 import numpy as np
-import gymnasium as gym
+import mujoco
+
+# degrees of freedom from which sparse Jacobians step faster. bars are separate free bodies, so dense ones stay
+# faster much longer than the 60 of jacobian="auto" in MuJoCo
+SPARSE_JACOBIAN_NV = 192
+# capsule-capsule and capsule-plane collisions make up to 2 contacts
+CONTACTS_PER_PAIR = 2
+# other bars a bar touches at once at most, beyond which contacts are dropped
+NEIGHBORS_PER_BAR = 4
+# constraint rows of a contact with condim 3 and the default pyramidal friction cone
+ROWS_PER_CONTACT = 4
 
 
 class Tensegrity:
@@ -20,13 +29,19 @@ class Tensegrity:
 
     def __init__(
             self, name, nodes, bars, cables, actuators,
-            path,
-            solver="Newoton",
+            path=None,
+            solver="Newton",
             integrator="RK4",
             stiffness=100,
             damping=1,
             ctrl_range=30,
             gear=50,
+            timestep=0.002,
+            iterations=100,
+            jacobian=None,
+            njmax=None,
+            nconmax=None,
+            nstack=None,
     ):
         """
         Args:
@@ -35,17 +50,24 @@ class Tensegrity:
             bars: pairs of bars, each bar is a list of the two ends
             cables: pairs of cables
             actuators: no. of actuated cables
-            path (string): Absolute path of folder for storing xml
+            path (string): Absolute path of folder for storing xml, not needed for the in-memory model
             solver (string): Constraint solver algorithms (PGS / CG / Newton)
             integrator (string): Numerical integrator (Euler / RK4 / implicit)
             stiffness: stiffness of cables, default 100
             damping: damping of cables, default 1
             ctrl_range: range of motor control
             gear: gear of motor
+            timestep: simulation timestep in seconds, default 0.002
+            iterations: max iterations of the constraint solver, default 100
+            jacobian (string): dense / sparse / auto. defaults to dense below `SPARSE_JACOBIAN_NV` degrees of
+            freedom and sparse above, see `size_options`
+            njmax: max number of constraint rows. defaults to the bound of `size_options`
+            nconmax: max number of contacts. defaults to the bound of `size_options`
+            nstack: size of the stack in mjtNums. defaults to the bound of `size_options`
         """
         self._name = name
         self._xml_filename = self._name + '.xml'
-        self._xml_path = osp.join(path, self._xml_filename)
+        self._xml_path = osp.join(path, self._xml_filename) if path is not None else None
 
         self._nodes = nodes
         self._bars = bars
@@ -58,28 +80,64 @@ class Tensegrity:
         self._damping = damping
         self._ctrl_range = ctrl_range
         self._gear = gear
+        self._timestep = timestep
+        self._iterations = iterations
+        self._jacobian = jacobian
+        self._njmax = njmax
+        self._nconmax = nconmax
+        self._nstack = nstack
+
+    def size_options(self):
+        """
+        Jacobian and memory sizes of the model, from the numbers of bars and cables unless given
 
-    def create_xml(self):
-        # Create xml model for tensegrity
+        .. note::
+
+            Every bar is a free body, which touches the floor and up to `NEIGHBORS_PER_BAR` other bars. There are
+            at most `CONTACTS_PER_PAIR` contacts per pair of those, `ROWS_PER_CONTACT` constraint rows per contact
+            and 2 rows per cable (its length limit and friction loss). The stack holds the dense matrices of the
+            solver, nv * nv and njmax * nv, plus njmax * njmax for PGS, which solves the dual problem, with a
+            margin of 4 over the use measured on falling designs.
+
+        Returns: dict of `jacobian`, `njmax`, `nconmax` and `nstack`
+
+        """
+        bar_num, cable_num = len(self._bars), len(self._cables)
+        nv = 6 * bar_num
+        pairs = min(bar_num * (bar_num - 1) // 2, NEIGHBORS_PER_BAR * bar_num // 2)
+        nconmax = CONTACTS_PER_PAIR * (bar_num + pairs)
+        njmax = ROWS_PER_CONTACT * nconmax + 2 * cable_num
+        nstack = 4 * (nv * nv + njmax * nv) + 10000
+        if self._solver == "PGS":
+            nstack += 4 * njmax * njmax
+        return dict(
+            jacobian=self._jacobian if self._jacobian is not None else (
+                "dense" if nv < SPARSE_JACOBIAN_NV else "sparse"),
+            njmax=self._njmax if self._njmax is not None else njmax,
+            nconmax=self._nconmax if self._nconmax is not None else nconmax,
+            nstack=self._nstack if self._nstack is not None else nstack,
+        )
 
+    def _xml_chunks(self):
+        """Pieces of the MJCF document, in order, with the geometry of all bars and cables computed at once"""
         # create scenic settings
         scene_msg = create_scene()
 
-        xml_file = open(self._xml_path, 'w')
-
         # file header
         header = f"""
 <mujoco model="{self._name}">
         """
         header += scene_msg
 
-        xml_file.write(header)
+        yield header
 
-        default = f"""
+        size = self.size_options()
+        yield f"""
 
-    <option timestep="0.002" iterations="100" solver="{self._solver}" integrator="{self._integrator}" jacobian="dense" gravity = "0 0 -9.8" viscosity="0"/>
+    <option timestep="{self._timestep}" iterations="{self._iterations}" solver="{self._solver}"
+        integrator="{self._integrator}" jacobian="{size['jacobian']}" gravity = "0 0 -9.8" viscosity="0"/>
 
-    <size njmax="5000" nconmax="500" nstack="5000000"/>
+    <size njmax="{size['njmax']}" nconmax="{size['nconmax']}" nstack="{size['nstack']}"/>
 
     <asset>
         <material name="rod" rgba=".7 .5 .3 1"/>
@@ -93,87 +151,202 @@ class Tensegrity:
         <camera pos="0 -10 0"/>
     </default>
         """
-        xml_file.write(default)
+
+        nodes = np.asarray(self._nodes)
+        bars = np.asarray(self._bars, dtype=int).reshape(-1, 2)
+        cables = np.asarray(self._cables, dtype=int).reshape(-1, 2)
 
         # world body
-        world_body_start = """
+        yield """
     <worldbody>
         """
-        xml_file.write(world_body_start)
 
-        for i in range(len(self._bars)):
-            node1 = self._nodes[self._bars[i][0]]
-            node2 = self._nodes[self._bars[i][1]]
-            bar_xml = f"""
+        # endpoints as Python numbers, which format like the numpy scalars of `nodes` and much faster
+        ends = nodes[bars].tolist()
+        for i, ((node1, node2), (end1, end2)) in enumerate(zip(bars.tolist(), ends)):
+            position1 = f"{end1[0]} {end1[1]} {end1[2]}"
+            position2 = f"{end2[0]} {end2[1]} {end2[2]}"
+            yield f"""
         <body name="bar{i + 1}">  
-            <geom name="bar{i + 1}" type="capsule" fromto="{node1[0]} {node1[1]} {node1[2]} {node2[0]} {node2[1]} {node2[2]}" material="rod"/>
-            <site name="b{self._bars[i][0]}" pos="{node1[0]} {node1[1]} {node1[2]}"/>
-            <site name="b{self._bars[i][1]}" pos="{node2[0]} {node2[1]} {node2[2]}"/>
+            <geom name="bar{i + 1}" type="capsule" fromto="{position1} {position2}" material="rod"/>
+            <site name="b{node1}" pos="{position1}"/>
+            <site name="b{node2}" pos="{position2}"/>
             <joint name="r{i + 1}" type="free" pos="0 0 0" limited="false" damping="0" armature="0" stiffness="0.2"/> 
         </body>
 """
-            xml_file.write(bar_xml)
 
-        world_body_end = """
+        yield """
     </worldbody>
         """
-        xml_file.write(world_body_end)
 
         # tendon
-        tendon_start = """
+        yield """
     <tendon>
         """
-        xml_file.write(tendon_start)
 
-        for i in range(len(self._cables)):
-            node1 = self._cables[i][0]
-            node2 = self._cables[i][1]
-            length = np.linalg.norm(self._nodes[node1]-self._nodes[node2])
-            tendon_xml = f"""
+        lengths = np.linalg.norm(nodes[cables[:, 0]] - nodes[cables[:, 1]], axis=1).tolist()
+        for i, ((node1, node2), length) in enumerate(zip(cables.tolist(), lengths)):
+            yield f"""
         <spatial name="S{i}" springlength="0 {length}">
             <site site="b{node1}"/>
             <site site="b{node2}"/>
         </spatial>
 """
-            xml_file.write(tendon_xml)
 
-        tendon_end = """
+        yield """
     </tendon>
         """
-        xml_file.write(tendon_end)
 
         # actuator
-        actuator_start = """
+        yield """
     <actuator>
         """
-        xml_file.write(actuator_start)
 
-        for i in range(len(self._actuators)):
-            actuator_xml = f"""
-        <motor tendon="S{self._actuators[i]}" gear="{self._gear}"/>
+        for actuator in np.asarray(self._actuators, dtype=int).ravel().tolist():
+            yield f"""
+        <motor tendon="S{actuator}" gear="{self._gear}"/>
 """
-            xml_file.write(actuator_xml)
 
-        actuator_end = """
+        yield """
     </actuator>
         """
-        xml_file.write(actuator_end)
 
         # file end
-        end = """
+        yield """
 </mujoco>
         """
-        xml_file.write(end)
 
-        xml_file.close()
+    def write_xml(self, fp):
+        """
+        Stream the MJCF model of the tensegrity to a file object, without building it in memory
+        Args:
+            fp: text file object, e.g. of `open(path, 'w')` or `io.StringIO`
+
+        .. note::
 
-    def register_gym(self, des):
+            Node coordinates of bars and rest lengths of cables are computed as whole arrays, and the pieces of the
+            document are handed to a single `writelines` call, which the buffer of the file object batches into
+            large writes. Build time is linear in the numbers of bars and cables.
+
+        """
+        fp.writelines(self._xml_chunks())
+
+    def to_xml_string(self):
+        """
+        Generate the MJCF model of the tensegrity in memory
+
+        Returns: a xml string of the whole model, identical to the content written by `create_xml`
+
+        """
+        return "".join(self._xml_chunks())
+
+    def create_xml(self):
+        # Create xml model for tensegrity
+        if self._xml_path is None:
+            raise ValueError("No path given for storing xml, use `to_xml_string` or `create_model` instead")
+
+        with open(self._xml_path, 'w') as xml_file:
+            self.write_xml(xml_file)
+
+    def topology_key(self):
+        """Everything the compiled model depends on except the coordinates of nodes and the options
+           of `set_options`
+        """
+        return (
+            self._name,
+            np.asarray(self._bars, dtype=int).tobytes(),
+            np.asarray(self._cables, dtype=int).tobytes(),
+            np.asarray(self._actuators, dtype=int).tobytes(),
+            self._stiffness, self._damping, self._ctrl_range, self._gear,
+            tuple(sorted(self.size_options().items())),
+        )
+
+    def set_options(self, model):
+        """
+        Set the simulation options of the tensegrity on a compiled model, as if compiled with them
+        Args:
+            model: `mujoco.MjModel` of the same topology, see `topology_key`
+        """
+        model.opt.timestep = self._timestep
+        model.opt.iterations = self._iterations
+        model.opt.integrator = getattr(mujoco.mjtIntegrator, "mjINT_" + self._integrator.upper())
+        model.opt.solver = getattr(mujoco.mjtSolver, "mjSOL_" + self._solver.upper())
+        model.opt.jacobian = getattr(mujoco.mjtJacobian, "mjJAC_" + self.size_options()["jacobian"].upper())
+
+    def create_model(self, model_cache=None, compiled_cache=None):
+        """
+        Compile the tensegrity directly into a Mujoco model, without touching the filesystem
+        Args:
+            model_cache: `TopologyModelCache`, which only compiles the first design of each topology
+            compiled_cache: `CompiledModelCache` on disk, which only compiles a MJCF it has never compiled
+
+        Returns: `mujoco.MjModel` of the tensegrity
+
+        """
+        if model_cache is not None:
+            return model_cache.model(self, compiled_cache)
+        # compiled from the MJCF text rather than built with `mujoco.MjSpec`, so that the model is exactly the one
+        # of the xml file and the text is a stable key of `CompiledModelCache`
+        if compiled_cache is not None:
+            return compiled_cache.model(self.to_xml_string())
+        return mujoco.MjModel.from_xml_string(self.to_xml_string())
+
+    def make_env(self, model_cache=None, compiled_cache=None, max_episode_steps=None, **kwargs):
+        """
+        Create a Gymnasium environment of the tensegrity from the in-memory model.
+        No xml file, asset copying or Gym registration is involved.
+        Args:
+            model_cache: `TopologyModelCache` passed to `create_model`
+            compiled_cache: `CompiledModelCache` passed to `create_model`
+            max_episode_steps: wrap the env in a `TimeLimit` of this many steps, e.g. 1000 as `register_gym`.
+            defaults to None, no time limit
+            **kwargs: keyword arguments passed to `TensegEnv`
+
+        Returns: `TensegEnv` of the tensegrity, wrapped in a `TimeLimit` if `max_episode_steps` is given
+
+        """
+        # Gymnasium and its MuJoCo envs are only imported once an env is made
+        from src.TensegrityModel.envs import TensegEnv
+        env = TensegEnv(self.create_model(model_cache, compiled_cache), bar_num=len(self._bars), **kwargs)
+        if max_episode_steps is not None:
+            from gymnasium.wrappers import TimeLimit
+            env = TimeLimit(env, max_episode_steps=max_episode_steps)
+        return env
+
+    def make_env_from_xml(self, directory=None, compiled_cache=None, **kwargs):
+        """
+        Create a Gymnasium environment of the tensegrity from its xml file, written to a private scratch
+        directory that is removed once the model is loaded. Unlike `register_gym`, nothing is copied to the
+        Gymnasium assets and the registry is not touched, so any number of threads or processes can do this
+        at once, with any names.
+        Args:
+            directory: parent of the scratch directory. defaults to the temporary directory of the system
+            compiled_cache: `CompiledModelCache` the env loads the model from
+            **kwargs: keyword arguments passed to `TensegEnv`
+
+        Returns: `TensegEnv` of the tensegrity, with the 1000 steps time limit of `register_gym`
+
+        """
+        from gymnasium.wrappers import TimeLimit
+        from src.TensegrityModel.envs import TensegEnv
+        with tempfile.TemporaryDirectory(prefix=self._name + "-", dir=directory) as scratch:
+            xml_path = osp.join(scratch, self._xml_filename)
+            with open(xml_path, 'w') as xml_file:
+                self.write_xml(xml_file)
+            env = TensegEnv(xml_path, bar_num=len(self._bars), compiled_cache=compiled_cache, **kwargs)
+        return TimeLimit(env, max_episode_steps=1000)
+
+    def register_gym(self, des, compiled_cache=None):
         """
         Register the tensegrity model in Gym
         Args:
             des: destination folder of 'asset' in Gymnasium package,
             usually `/home/$username$/anaconda3/envs/gym/lib/python3.8/site-packages/gymnasium/envs/mujoco/assets`
+            compiled_cache: `CompiledModelCache` the env loads the model from
         """
+        import subprocess
+        import gymnasium as gym
+        from gymnasium.envs.registration import register
         des_path = osp.join(des, self._xml_filename)
         subprocess.run(['cp', self._xml_path, des_path])
 
@@ -181,19 +354,45 @@ class Tensegrity:
             id=self._name,
             entry_point="src.TensegrityModel.envs:TensegEnv",
             max_episode_steps=1000,
-            kwargs={'xml_file': self._xml_filename, 'bar_num': len(self._bars)},
+            kwargs={'xml_file': self._xml_filename, 'bar_num': len(self._bars), 'compiled_cache': compiled_cache},
         )
         env = gym.make(self._name)
         return env
         pass
 
     def clean(self, des, clean_file=False):
+        import gymnasium as gym
         del gym.envs.registration.registry[self._name]
         if osp.exists(osp.join(des, self._xml_filename)):
             os.remove(osp.join(des, self._xml_filename))
         if clean_file:
             os.remove(self._xml_path)
 
+    @property
+    def nodes(self):
+        return np.asarray(self._nodes, dtype=float)
+
+    @property
+    def bars(self):
+        return np.asarray(self._bars, dtype=int)
+
+    @property
+    def cables(self):
+        return np.asarray(self._cables, dtype=int)
+
+    @property
+    def actuators(self):
+        return np.asarray(self._actuators, dtype=int)
+
+    @property
+    def options(self):
+        """Keyword arguments of the simulation options of the tensegrity, as given"""
+        return dict(
+            solver=self._solver, integrator=self._integrator, stiffness=self._stiffness, damping=self._damping,
+            ctrl_range=self._ctrl_range, gear=self._gear, timestep=self._timestep, iterations=self._iterations,
+            jacobian=self._jacobian, njmax=self._njmax, nconmax=self._nconmax, nstack=self._nstack,
+        )
+
     @property
     def get_name(self):
         return self._name
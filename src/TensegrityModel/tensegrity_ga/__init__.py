@@ -1 +1,33 @@
-from src.TensegrityModel.tensegrity_ga.tensegrity_ga import TensegrityGA
+from src.TensegrityModel.lazy_import import lazy_attributes
+
+_ATTRIBUTES = {
+    "TensegrityGA": "src.TensegrityModel.tensegrity_ga.tensegrity_ga",
+    "FitnessCache": "src.TensegrityModel.tensegrity_ga.fitness_cache",
+    "StabilityEvaluator": "src.TensegrityModel.tensegrity_ga.stability",
+    "StabilityResult": "src.TensegrityModel.tensegrity_ga.stability",
+    "GAObserver": "src.TensegrityModel.tensegrity_ga.telemetry",
+    "ConsolePrinter": "src.TensegrityModel.tensegrity_ga.telemetry",
+    "JsonLinesLogger": "src.TensegrityModel.tensegrity_ga.telemetry",
+    "load_checkpoint": "src.TensegrityModel.tensegrity_ga.checkpoint",
+    "save_checkpoint": "src.TensegrityModel.tensegrity_ga.checkpoint",
+    "read_history": "src.TensegrityModel.tensegrity_ga.checkpoint",
+    "EquilibriumPrefilter": "src.TensegrityModel.tensegrity_ga.equilibrium",
+    "PrefilterResult": "src.TensegrityModel.tensegrity_ga.equilibrium",
+    "Canonicalizer": "src.TensegrityModel.tensegrity_ga.canonical",
+    "DistributedEvaluator": "src.TensegrityModel.tensegrity_ga.distributed",
+    "run_worker": "src.TensegrityModel.tensegrity_ga.distributed",
+    "start_local_workers": "src.TensegrityModel.tensegrity_ga.distributed",
+    "SurrogateModel": "src.TensegrityModel.tensegrity_ga.surrogate",
+    "SuccessiveHalving": "src.TensegrityModel.tensegrity_ga.multi_fidelity",
+    "FidelityLevel": "src.TensegrityModel.tensegrity_ga.multi_fidelity",
+}
+__all__ = list(_ATTRIBUTES)
+
+# submodules, bound to the package like after an eager import
+_SUBMODULES = {
+    name: "src.TensegrityModel.tensegrity_ga." + name
+    for name in ("canonical", "checkpoint", "distributed", "equilibrium", "fitness_cache", "multi_fidelity",
+                 "stability", "surrogate", "telemetry", "tensegrity_ga")
+}
+
+__getattr__, __dir__ = lazy_attributes(__name__, dict(_ATTRIBUTES, **_SUBMODULES))
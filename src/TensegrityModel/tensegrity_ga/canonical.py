@@ -0,0 +1,205 @@
+import numpy as np
+from src.TensegrityModel.tensegrity_ga.fitness_cache import structure_key
+
+INVARIANCES = ("none", "yaw", "rigid")
+
+
+def refine_colors(node_num, bars, cables, colors=None):
+    """
+    Color refinement (1-dimensional Weisfeiler-Lehman) of the graph of bars and cables
+    Args:
+        node_num: number of nodes
+        bars: bar num * 2
+        cables: cable num * 2
+        colors: initial colors of nodes. defaults to the numbers of bars and cables at each node
+
+    Returns: colors of nodes, integers that do not depend on the labels of nodes or the order of members
+
+    """
+    members = np.concatenate((bars, cables)).astype(int)
+    kinds = np.concatenate((np.zeros(len(bars), dtype=int), np.ones(len(cables), dtype=int)))
+    if colors is None:
+        colors = np.zeros((node_num, 2), dtype=int)
+        np.add.at(colors, (members[:, 0], kinds), 1)
+        np.add.at(colors, (members[:, 1], kinds), 1)
+    _, colors = np.unique(colors, axis=0, return_inverse=True)
+    colors = colors.reshape(-1)
+
+    neighbors = [[] for _ in range(node_num)]
+    for (node1, node2), kind in zip(members, kinds):
+        neighbors[node1].append((kind, node2))
+        neighbors[node2].append((kind, node1))
+
+    for _ in range(node_num):
+        signatures = [(colors[i],) + tuple(sorted((kind, colors[j]) for kind, j in neighbors[i]))
+                      for i in range(node_num)]
+        index = {signature: color for color, signature in enumerate(sorted(set(signatures)))}
+        refined = np.asarray([index[signature] for signature in signatures])
+        if len(index) == len(np.unique(colors)):
+            return refined
+        colors = refined
+    return colors
+
+
+class Canonicalizer(object):
+    """
+    Canonical key of a decoded tensegrity, the same for designs equal up to node labels, the order of bars and
+    cables, and optionally a rigid transform of the coordinates
+
+    .. note::
+
+        Nodes are colored by color refinement of the bar and cable graph, refined by pose invariants (distance
+        to the centroid, or height and horizontal distance to the vertical axis through the centroid). The pose
+        is normalized by candidate frames built from the nodes of the smallest color class, coordinates are
+        quantized to `tol`, and the smallest representation over the candidates is hashed. Designs within `tol`
+        of each other usually share a key, except close to a rounding boundary.
+
+        The first bar is kept: `TensegEnv` takes health, termination and velocity from `bar1`, so its two nodes
+        seed their own color and the first bar leads the bars of the form. Designs that only differ in which bar is
+        first get different keys.
+
+        `invariance="none"`, the default, only removes labels and the order of the other bars and of the cables.
+        Such designs are the same model up to the order of the other bodies, so a seeded reset draws other noise
+        for each of those bars but from the same distribution.
+        `"yaw"` also removes rotations about the vertical axis and horizontal translations, and `"rigid"` any
+        proper rotation and translation. Both are approximations that trade exactness for hit rate: gravity and
+        the floor are invariant under yaw, but the reset noise of `TensegEnv` is applied in world coordinates
+        about the origin, so such designs are not simulated identically and share the fitness of whichever was
+        simulated first.
+
+    """
+
+    def __init__(self, invariance="none", tol=1e-6):
+        """
+        Args:
+            invariance: "none", "yaw" or "rigid"
+            tol: quantization of coordinates after pose normalization
+        """
+        if invariance not in INVARIANCES:
+            raise ValueError(f"Unknown invariance {invariance}, expected one of {INVARIANCES}")
+        self._invariance = invariance
+        self._tol = tol
+
+    def __repr__(self):
+        return "Canonicalizer%r" % (self.params,)
+
+    @property
+    def params(self):
+        """All settings that affect the key"""
+        return (self._invariance, self._tol)
+
+    def _quantize(self, values):
+        return np.round(np.asarray(values) / self._tol).astype(np.int64)
+
+    def _frames(self, nodes, colors):
+        """Candidate poses, as (center, rotation) with coordinates (nodes - center) @ rotation"""
+        if self._invariance == "none":
+            return [(np.zeros(3), np.eye(3))]
+
+        center = nodes.mean(axis=0)
+        if self._invariance == "yaw":
+            center[2] = 0
+        centered = nodes - center
+        if self._invariance == "yaw":
+            centered = centered * [1, 1, 0]
+        radius = self._quantize(np.linalg.norm(centered, axis=1))
+
+        # nodes off the axis (or center), by class, smallest class first
+        classes = {}
+        for i in np.flatnonzero(radius > 0):
+            classes.setdefault(colors[i], []).append(i)
+        classes = sorted(classes.values(), key=lambda members: (len(members), colors[members[0]]))
+        if not classes:
+            return [(center, np.eye(3))]
+
+        frames = []
+        for a in classes[0]:
+            x = centered[a] / np.linalg.norm(centered[a])
+            if self._invariance == "yaw":
+                frames.append((center, np.array([[x[0], -x[1], 0], [x[1], x[0], 0], [0, 0, 1]])))
+                continue
+            # the second axis from every node of the first class with a node off the line of a
+            found = False
+            for members in classes:
+                for b in members:
+                    y = centered[b] - np.dot(centered[b], x) * x
+                    if self._quantize(np.linalg.norm(y)) > 0:
+                        y = y / np.linalg.norm(y)
+                        frames.append((center, np.stack((x, y, np.cross(x, y)), axis=1)))
+                        found = True
+                if found:
+                    break
+            if not found:
+                # all nodes on a line, any axis perpendicular to it
+                y = np.eye(3)[np.argmin(np.abs(x))]
+                y = (y - np.dot(y, x) * x) / np.linalg.norm(y - np.dot(y, x) * x)
+                frames.append((center, np.stack((x, y, np.cross(x, y)), axis=1)))
+        return frames
+
+    def canonical_form(self, nodes, bars, cables):
+        """
+        Relabel and normalize a decoded tensegrity
+        Args:
+            nodes: node num * 3
+            bars: bar num * 2
+            cables: cable num * 2
+
+        Returns: quantized nodes (node num * 3, in units of `tol`), bars and cables of the canonical form
+
+        """
+        nodes = np.asarray(nodes, dtype=float)
+        bars = np.asarray(bars, dtype=int).reshape(-1, 2)
+        cables = np.asarray(cables, dtype=int).reshape(-1, 2)
+
+        # pose invariants refine the colors of the graph
+        center = nodes.mean(axis=0)
+        if self._invariance == "rigid":
+            invariants = self._quantize(np.linalg.norm(nodes - center, axis=1))[:, np.newaxis]
+        elif self._invariance == "yaw":
+            invariants = np.stack((self._quantize(np.linalg.norm((nodes - center)[:, :2], axis=1)),
+                                   self._quantize(nodes[:, 2])), axis=1)
+        else:
+            invariants = self._quantize(nodes)
+        first = np.zeros((len(nodes), 1), dtype=int)
+        if len(bars):
+            first[bars[0]] = 1
+        colors = refine_colors(len(nodes), bars, cables)
+        colors = refine_colors(len(nodes), bars, cables, np.column_stack((first, colors, invariants)))
+
+        best = None
+        for center, rotation in self._frames(nodes, colors):
+            coordinates = self._quantize((nodes - center) @ rotation)
+            order = np.lexsort(coordinates.T[::-1])
+            order = order[np.argsort(colors[order], kind='stable')]
+            label = np.empty(len(nodes), dtype=int)
+            label[order] = np.arange(len(nodes))
+            form = (
+                coordinates[order],
+                np.concatenate((np.sort(label[bars[:1]], axis=1), self._members(label[bars[1:]]))),
+                self._members(label[cables]),
+            )
+            if best is None or self._smaller(form, best):
+                best = form
+        return best
+
+    @staticmethod
+    def _members(members):
+        members = np.sort(members, axis=1)
+        return members[np.lexsort(members.T[::-1])]
+
+    @staticmethod
+    def _smaller(form, other):
+        for array, other_array in zip(form, other):
+            difference = np.flatnonzero(array.ravel() != other_array.ravel())
+            if len(difference):
+                return array.ravel()[difference[0]] < other_array.ravel()[difference[0]]
+        return False
+
+    def key(self, nodes, bars, cables, sim_params):
+        """
+        Canonical key of a decoded tensegrity simulated with `sim_params`
+        Returns: a hex string, distinct from the keys of `structure_key`
+
+        """
+        form_nodes, form_bars, form_cables = self.canonical_form(nodes, bars, cables)
+        return structure_key(form_nodes, form_bars, form_cables, dict(sim_params, canonical=self.params))
@@ -0,0 +1,199 @@
+import glob
+import json
+import os
+import numpy as np
+from src.TensegrityModel.tensegrity_ga.telemetry import GAObserver
+
+STATE_FILE = "state.json"
+HISTORY_FILE = "history.bin"
+
+
+def history_dtype(population_size):
+    """Fixed-size record of one generation in the history file"""
+    return np.dtype([
+        ("generation", np.int64),
+        ("best_fitness", np.float64),
+        ("mean_fitness", np.float64),
+        ("evaluations", np.int64),
+        ("steps", np.int64),
+        ("evaluation_wall", np.float64),
+        ("fitness", np.float64, (population_size,)),
+    ])
+
+
+def _atomic_save(path, array):
+    temp = path + ".tmp"
+    with open(temp, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def _atomic_savez(path, arrays):
+    temp = path + ".tmp"
+    with open(temp, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def _atomic_json(path, obj):
+    temp = path + ".tmp"
+    with open(temp, 'w') as f:
+        json.dump(obj, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def save_checkpoint(ga, directory, generation=None):
+    """
+    Save the ranked population, the RNG state, the generation counter, the surrogate and the fitness values
+    memoized in memory of `ga`
+    Args:
+        ga: `TensegrityGA` at the end of a generation
+        directory: checkpoint directory
+        generation: number of generations evaluated. defaults to `ga.generation`
+
+    .. note::
+
+        Genes and fitness are `.npy` files named after the generation, and `state.json` is replaced last
+        to point at them, so a crash at any time leaves the previous checkpoint intact. Memoized values are
+        saved since a hit skips the surrogate, which would otherwise draw and learn differently after a resume.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    if generation is None:
+        generation = ga.generation
+    genes_file = "genes-%06d.npy" % generation
+    fitness_file = "fitness-%06d.npy" % generation
+    _atomic_save(os.path.join(directory, genes_file), ga._genes)
+    _atomic_save(os.path.join(directory, fitness_file), ga._fitness)
+    surrogate_file, surrogate = None, None
+    if ga._surrogate is not None:
+        surrogate_file = "surrogate-%06d.npz" % generation
+        arrays, surrogate = ga._surrogate.get_state()
+        _atomic_savez(os.path.join(directory, surrogate_file), arrays)
+    cache_file = None
+    if ga._cache is not None:
+        cache_file = "cache-%06d.npz" % generation
+        keys, values = ga._cache.snapshot()
+        _atomic_savez(os.path.join(directory, cache_file), dict(keys=keys, values=values))
+    _atomic_json(os.path.join(directory, STATE_FILE), {
+        "generation": generation,
+        "strut_num": ga._strut_num,
+        "population_size": ga._population_size,
+        "gene_len": ga._gene_len,
+        "genes": genes_file,
+        "fitness": fitness_file,
+        "rng": ga._rng.bit_generator.state,
+        "surrogate_file": surrogate_file,
+        "surrogate": surrogate,
+        "cache_file": cache_file,
+    })
+
+    # files of older checkpoints
+    for path in (glob.glob(os.path.join(directory, "genes-*.npy")) + glob.glob(os.path.join(directory, "fitness-*.npy"))
+                 + glob.glob(os.path.join(directory, "surrogate-*.npz"))
+                 + glob.glob(os.path.join(directory, "cache-*.npz"))):
+        if os.path.basename(path) not in (genes_file, fitness_file, surrogate_file, cache_file):
+            os.remove(path)
+
+
+def load_checkpoint(ga, directory, mmap_mode=None):
+    """
+    Restore `ga` from the checkpoint in `directory`, so that a run continues as if never stopped
+    Args:
+        ga: `TensegrityGA` with the same settings as the checkpointed one
+        directory: checkpoint directory
+        mmap_mode: passed to `np.load`, e.g. 'r' to memory-map the population
+
+    Returns: number of generations in the checkpoint, 0 if there is none
+
+    """
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        state = json.load(f)
+    for key in ("strut_num", "population_size", "gene_len"):
+        if state[key] != getattr(ga, "_" + key):
+            raise ValueError("Checkpoint has %s %d, but the GA has %d" % (key, state[key], getattr(ga, "_" + key)))
+
+    ga._genes = np.load(os.path.join(directory, state["genes"]), mmap_mode=mmap_mode)
+    ga._fitness = np.load(os.path.join(directory, state["fitness"]), mmap_mode=mmap_mode)
+    ga._rng.bit_generator.state = state["rng"]
+    ga._generation = state["generation"]
+    if ga._surrogate is not None:
+        if state.get("surrogate_file") is None:
+            raise ValueError("Checkpoint has no surrogate, but the GA has one")
+        with np.load(os.path.join(directory, state["surrogate_file"])) as arrays:
+            ga._surrogate.set_state(dict(arrays), state["surrogate"])
+    if ga._cache is not None and state.get("cache_file") is not None:
+        with np.load(os.path.join(directory, state["cache_file"])) as arrays:
+            ga._cache.restore(arrays["keys"], arrays["values"])
+
+    # generations logged after the checkpoint are run again
+    history = os.path.join(directory, HISTORY_FILE)
+    if os.path.exists(history):
+        size = state["generation"] * history_dtype(state["population_size"]).itemsize
+        if os.path.getsize(history) > size:
+            os.truncate(history, size)
+    return state["generation"]
+
+
+def read_history(directory, population_size):
+    """
+    Memory-map the generation history of a run, without loading it
+    Args:
+        directory: checkpoint directory
+        population_size: population size of the run
+
+    Returns: record array with the fields of `history_dtype`, one record per generation
+
+    """
+    path = os.path.join(directory, HISTORY_FILE)
+    if not os.path.getsize(path):
+        return np.empty(0, dtype=history_dtype(population_size))
+    return np.memmap(path, dtype=history_dtype(population_size), mode='r')
+
+
+class Checkpointer(GAObserver):
+    """Append every generation to the history and save a checkpoint every `every` generations"""
+
+    def __init__(self, directory, every=1):
+        """
+        Args:
+            directory: checkpoint directory
+            every: number of generations between checkpoints. the last generation is always saved
+        """
+        self._directory = directory
+        self._every = every
+
+    def on_run_start(self, ga):
+        # a run from scratch starts a new history
+        if ga.generation == 0:
+            os.makedirs(self._directory, exist_ok=True)
+            open(os.path.join(self._directory, HISTORY_FILE), 'wb').close()
+
+    def on_generation(self, ga, record):
+        os.makedirs(self._directory, exist_ok=True)
+        entry = np.zeros(1, dtype=history_dtype(ga._population_size))
+        entry["generation"] = record["generation"]
+        entry["best_fitness"] = record["best_fitness"]
+        entry["mean_fitness"] = record["mean_fitness"]
+        entry["evaluations"] = record["evaluations"]
+        entry["steps"] = record["steps"]
+        entry["evaluation_wall"] = record["evaluation_wall"]
+        entry["fitness"] = ga._fitness
+        with open(os.path.join(self._directory, HISTORY_FILE), 'ab') as f:
+            f.write(entry.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        # the generation is counted once observers are notified
+        generations = record["generation"] + 1
+        if generations % self._every == 0 or generations == ga._generations:
+            save_checkpoint(ga, self._directory, generations)
@@ -0,0 +1,438 @@
+"""
+Fitness evaluation on worker processes of any host, connected to a coordinator over TCP.
+
+The coordinator listens on localhost unless given another address, and only accepts workers presenting its
+token. Run the GA with a coordinator listening on all interfaces:
+
+    with DistributedEvaluator(host="0.0.0.0", port=5555, token=token) as evaluator:
+        ga.run(evaluator=evaluator)
+
+and start workers on every host, e.g. 8 per host, with the token in the environment:
+
+    TENSEGRITY_WORKER_TOKEN=token python -m src.TensegrityModel.tensegrity_ga.distributed \
+        --host coordinator-host --port 5555 --processes 8
+"""
+import argparse
+import collections
+import hmac
+import json
+import multiprocessing as mp
+import os
+import secrets
+import socket
+import struct
+import threading
+import time
+import traceback
+from concurrent import futures
+import numpy as np
+from src.TensegrityModel.tensegrity_ga.stability import StabilityResult
+
+# messages are a kind, a payload length and the payload
+HEADER = struct.Struct("!4sQ")
+# max size of the HELLO of a worker, and seconds it has to send it, before it is authenticated
+MAX_HELLO_SIZE = 1 << 16
+HELLO_TIMEOUT = 10
+# environment variable of the token of workers started from the command line
+TOKEN_VARIABLE = "TENSEGRITY_WORKER_TOKEN"
+# batch id, number of genes or results, gene length and rung of multi-fidelity evaluation, -1 for None
+BATCH = struct.Struct("!QIIi")
+
+HELLO = b"HELO"
+CONFIG = b"CONF"
+TASK = b"TASK"
+RESULT = b"RSLT"
+ERROR = b"ERRR"
+STOP = b"STOP"
+
+REASONS = ("terminated", "diverged", "settled", "max_steps", "prefilter")
+PREFILTER_REASONS = (None, "feasible", "degenerate", "no_self_stress", "not_super_stable", "free_fall")
+RESULT_DTYPE = np.dtype([
+    ("fitness", "<f8"),
+    ("stable", "u1"),
+    ("steps", "<i8"),
+    ("reason", "u1"),
+    ("prefilter", "u1"),
+    ("start", "<f8"),
+    ("end", "<f8"),
+])
+
+
+def send_message(sock, kind, payload=b""):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock, max_size=None):
+    kind, size = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if max_size is not None and size > max_size:
+        raise ConnectionError("Message of %d bytes exceeds %d" % (size, max_size))
+    return kind, _recv_exact(sock, size)
+
+
+def _level(level):
+    return -1 if level is None else level
+
+
+def encode_genes(batch_id, genes, level=None):
+    genes = np.ascontiguousarray(genes, dtype="<f8")
+    return BATCH.pack(batch_id, *genes.shape, _level(level)) + genes.tobytes()
+
+
+def decode_genes(payload):
+    batch_id, count, gene_len, level = BATCH.unpack_from(payload)
+    genes = np.frombuffer(payload, dtype="<f8", offset=BATCH.size).reshape(count, gene_len)
+    return batch_id, genes, level if level >= 0 else None
+
+
+def encode_results(batch_id, evaluations, level=None):
+    """Pack `_evaluate_timed` results, with the phases of each evaluation as a JSON trailer"""
+    results = np.zeros(len(evaluations), dtype=RESULT_DTYPE)
+    for i, (fitness, result, timing) in enumerate(evaluations):
+        results[i] = (fitness, result.stable, result.steps, REASONS.index(result.reason),
+                      PREFILTER_REASONS.index(timing["prefilter"]), timing["start"], timing["end"])
+    phases = json.dumps([timing["phases"] for _, _, timing in evaluations]).encode()
+    return BATCH.pack(batch_id, len(results), 0, _level(level)) + results.tobytes() + phases
+
+
+def decode_results(payload, worker):
+    """Unpack results into `_evaluate_timed` results"""
+    batch_id, count, _, level = BATCH.unpack_from(payload)
+    results = np.frombuffer(payload, dtype=RESULT_DTYPE, count=count, offset=BATCH.size)
+    phases = json.loads(payload[BATCH.size + results.nbytes:].decode())
+    evaluations = []
+    for result, phase in zip(results, phases):
+        evaluations.append((
+            float(result["fitness"]),
+            StabilityResult(bool(result["stable"]), int(result["steps"]), REASONS[result["reason"]]),
+            {"worker": worker, "start": float(result["start"]), "end": float(result["end"]),
+             "phases": phase, "prefilter": PREFILTER_REASONS[result["prefilter"]],
+             "fidelity": level if level >= 0 else None},
+        ))
+    return batch_id, evaluations
+
+
+class DistributedEvaluator(object):
+    """
+    Coordinator handing out batches of genes to workers connected over TCP
+
+    .. note::
+
+        Used by `TensegrityGA.run(evaluator=...)` in place of the local pool of workers, in generational and
+        steady-state mode. Genes are queued by `submit`, and every connected worker is sent the next
+        `batch_size` of them as soon as it returns its previous batch. Workers are configured with the settings
+        of the GA as JSON, nothing is pickled. A batch whose worker disconnects or exceeds `task_timeout` is
+        queued again, up to `max_retries` times. Genes queued while no worker is connected fail after
+        `worker_timeout`, so a run without workers raises instead of blocking. Results are matched to their
+        genes, so the fitness vector of a generation is in population order.
+
+        Workers send results that go straight into the GA, so only clients whose HELLO carries `token` are
+        accepted. The coordinator listens on localhost by default, and other hosts can only connect when
+        `host` is given, e.g. "0.0.0.0" for all interfaces. The token is not encrypted, so use a trusted network.
+
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, batch_size=4, task_timeout=None, max_retries=3, token=None,
+                 worker_timeout=60):
+        """
+        Args:
+            host: address to listen on. defaults to localhost, "0.0.0.0" listens on all interfaces
+            port: port to listen on. defaults to a free port, see `address`
+            batch_size: max number of genes sent to a worker at once
+            task_timeout: seconds after which a worker that has not returned its batch is dropped. defaults to None
+            max_retries: number of times the genes of a lost batch are sent again
+            token: shared secret workers must present. defaults to a random one, see `token`
+            worker_timeout: seconds genes stay queued with no worker connected before they fail, None to wait
+            forever
+        """
+        self._token = token if token is not None else secrets.token_hex(16)
+        self._batch_size = batch_size
+        self._task_timeout = task_timeout
+        self._max_retries = max_retries
+        self._worker_timeout = worker_timeout
+
+        self._config = None
+        self._config_version = 0
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._workers = {}
+        self._closed = False
+        self._batch_ids = iter(range(1 << 62))
+
+        self._server = socket.create_server((host, port))
+        self._accept_thread = threading.Thread(target=self._accept, name="DistributedAccept", daemon=True)
+        self._accept_thread.start()
+        if worker_timeout is not None:
+            self._watch_thread = threading.Thread(target=self._watch, name="DistributedWatch", daemon=True)
+            self._watch_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def address(self):
+        """Host and port the coordinator listens on"""
+        return self._server.getsockname()[:2]
+
+    @property
+    def token(self):
+        """Shared secret of the workers, passed to `run_worker`"""
+        return self._token
+
+    @property
+    def workers(self):
+        """Number of connected workers"""
+        with self._condition:
+            return len(self._workers)
+
+    def configure(self, ga):
+        """Send the settings of `ga` to all workers, before its first evaluation"""
+        with self._condition:
+            self._config = json.dumps(ga.worker_config()).encode()
+            self._config_version += 1
+            self._condition.notify_all()
+
+    def wait_for_workers(self, count, timeout=None):
+        """Block until `count` workers are connected, returns whether they are"""
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._workers) >= count, timeout=timeout)
+
+    def submit(self, index, gene, level=None):
+        """Queue the evaluation of a gene, at a rung of multi-fidelity evaluation if `level` is given,
+           the future returns (index, `_evaluate_timed` result)
+        """
+        future = futures.Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed DistributedEvaluator")
+            self._queue.append((future, index, np.asarray(gene), level, 0))
+            # wakes a worker and the watch thread
+            self._condition.notify_all()
+        return future
+
+    def close(self):
+        """Stop all workers and the coordinator, and fail the evaluations left"""
+        with self._condition:
+            self._closed = True
+            for future, _, _, _, _ in self._queue:
+                future.set_exception(RuntimeError("DistributedEvaluator closed"))
+            self._queue.clear()
+            self._condition.notify_all()
+        self._server.close()
+        for thread in list(self._workers.values()):
+            thread.join()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self._server.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._serve, args=(sock, address), daemon=True,
+                                      name="DistributedWorker-%s:%d" % address[:2])
+            thread.start()
+
+    def _watch(self):
+        """Fail the queued genes once they have waited `worker_timeout` seconds with no worker connected"""
+        idle_since = None
+        with self._condition:
+            while not self._closed:
+                if self._workers or not self._queue:
+                    idle_since = None
+                    self._condition.wait()
+                    continue
+                if idle_since is None:
+                    idle_since = time.monotonic()
+                remaining = idle_since + self._worker_timeout - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                error = RuntimeError("No worker connected to the DistributedEvaluator at %s:%d for %g s"
+                                     % (tuple(self.address) + (self._worker_timeout,)))
+                for future, _, _, _, _ in self._queue:
+                    future.set_exception(error)
+                self._queue.clear()
+                idle_since = None
+
+    def _take_batch(self):
+        """Wait for queued genes, returns up to `batch_size` of them or None when closed"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._queue or self._closed)
+            if self._closed:
+                return None
+            batch = []
+            # a batch is evaluated at a single rung
+            level = self._queue[0][3]
+            while self._queue and len(batch) < self._batch_size and self._queue[0][3] == level:
+                future, index, gene, level, retries = self._queue.popleft()
+                # retried futures are already running
+                if retries or future.set_running_or_notify_cancel():
+                    batch.append((future, index, gene, level, retries))
+            return batch
+
+    def _requeue(self, batch, error):
+        with self._condition:
+            for future, index, gene, level, retries in reversed(batch):
+                if retries >= self._max_retries:
+                    future.set_exception(RuntimeError("Evaluation failed %d times: %s" % (retries + 1, error)))
+                else:
+                    self._queue.appendleft((future, index, gene, level, retries + 1))
+            self._condition.notify_all()
+
+    def _serve(self, sock, address):
+        name = "%s:%d" % address[:2]
+        batch = []
+        try:
+            sock.settimeout(HELLO_TIMEOUT)
+            kind, payload = recv_message(sock, MAX_HELLO_SIZE)
+            sock.settimeout(None)
+            if kind != HELLO:
+                raise ConnectionError("Unexpected message %r from %s" % (kind, name))
+            hello = json.loads(payload.decode())
+            if not isinstance(hello, dict):
+                raise ConnectionError("Malformed HELLO from %s" % name)
+            if not hmac.compare_digest(str(hello.get("token", "")).encode(), self._token.encode()):
+                raise ConnectionError("Worker %s sent a wrong token" % name)
+            name = hello.get("name", name)
+            with self._condition:
+                self._workers[sock] = threading.current_thread()
+                self._condition.notify_all()
+
+            version = 0
+            while True:
+                batch = self._take_batch()
+                if batch is None:
+                    send_message(sock, STOP)
+                    return
+                if not batch:
+                    continue
+                with self._condition:
+                    config, current = self._config, self._config_version
+                if config is None:
+                    # not the fault of the worker, which stays connected
+                    error = RuntimeError("DistributedEvaluator is not configured with a GA")
+                    for future, _, _, _, _ in batch:
+                        future.set_exception(error)
+                    batch = []
+                    continue
+                if version != current:
+                    send_message(sock, CONFIG, config)
+                    version = current
+
+                batch_id = next(self._batch_ids)
+                send_message(sock, TASK, encode_genes(batch_id, np.stack([gene for _, _, gene, _, _ in batch]),
+                                                      batch[0][3]))
+                sock.settimeout(self._task_timeout)
+                kind, payload = recv_message(sock)
+                sock.settimeout(None)
+                if kind == ERROR:
+                    error = RuntimeError("Worker %s failed:\n%s" % (name, payload.decode()))
+                    for future, _, _, _, _ in batch:
+                        future.set_exception(error)
+                    batch = []
+                    continue
+                result_id, evaluations = decode_results(payload, name)
+                if kind != RESULT or result_id != batch_id or len(evaluations) != len(batch):
+                    raise ConnectionError("Unexpected reply from %s" % name)
+                for (future, index, _, _, _), evaluation in zip(batch, evaluations):
+                    future.set_result((index, evaluation))
+                batch = []
+        except Exception as error:
+            # lost or misbehaving worker (e.g. a truncated or malformed reply), its batch goes to the others
+            if batch:
+                self._requeue(batch, error)
+        finally:
+            with self._condition:
+                self._workers.pop(sock, None)
+                self._condition.notify_all()
+            sock.close()
+
+
+def run_worker(host, port, connect_timeout=30, token=None):
+    """
+    Evaluate genes for a coordinator until it stops
+    Args:
+        host: host of the `DistributedEvaluator`
+        port: port of the `DistributedEvaluator`
+        connect_timeout: seconds to keep trying to connect
+        token: `token` of the `DistributedEvaluator`. defaults to the `TENSEGRITY_WORKER_TOKEN` variable
+    """
+    if token is None:
+        token = os.environ.get(TOKEN_VARIABLE, "")
+    # imported here, so that the GA module is not needed to import the coordinator side
+    from src.TensegrityModel.tensegrity_ga.tensegrity_ga import TensegrityGA
+
+    deadline = time.time() + connect_timeout
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(.5)
+
+    ga = None
+    with sock:
+        send_message(sock, HELLO, json.dumps({"name": "%s/%d" % (socket.gethostname(), os.getpid()),
+                                              "token": token}).encode())
+        while True:
+            try:
+                kind, payload = recv_message(sock)
+            except ConnectionError:
+                return
+            if kind == STOP:
+                return
+            if kind == CONFIG:
+                ga = TensegrityGA.from_worker_config(json.loads(payload.decode()))
+            elif kind == TASK:
+                batch_id, genes, level = decode_genes(payload)
+                try:
+                    evaluations = [ga._evaluate_timed(gene, level) for gene in genes]
+                except Exception:
+                    send_message(sock, ERROR, traceback.format_exc().encode())
+                    continue
+                send_message(sock, RESULT, encode_results(batch_id, evaluations, level))
+
+
+def start_local_workers(host, port, processes, context=None, token=None):
+    """Start `processes` workers on this machine with the `token` of the coordinator, returns the processes"""
+    ctx = mp.get_context(context)
+    workers = [ctx.Process(target=run_worker, args=(host, port, 30, token), daemon=True) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost", help="host of the coordinator")
+    parser.add_argument("--port", type=int, required=True, help="port of the coordinator")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="number of workers on this host")
+    parser.add_argument("--connect-timeout", type=float, default=30)
+    args = parser.parse_args(argv)
+
+    # the token is read from TENSEGRITY_WORKER_TOKEN, not from the command line where other users could see it
+    workers = [mp.Process(target=run_worker, args=(args.host, args.port, args.connect_timeout))
+               for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import zlib
+from collections import namedtuple
+import numpy as np
+
+PrefilterResult = namedtuple('PrefilterResult', ['feasible', 'reason', 'stress'])
+
+# height of the floor of `create_scene` and radius of the bars of `Tensegrity`
+FLOOR_Z = -0.1
+BAR_RADIUS = 0.02
+
+
+def equilibrium_matrix(nodes, bars, cables):
+    """
+    Equilibrium matrix of a pin-jointed structure in force densities
+    Args:
+        nodes: node num * 3
+        bars: bar num * 2
+        cables: cable num * 2
+
+    Returns: (3 * node num) * (bar num + cable num) matrix A, where A @ q are the nodal forces of
+    force densities q (force / length, bars first). q is a self-stress if A @ q == 0
+
+    """
+    members = np.concatenate((bars, cables)).astype(int)
+    # edge vectors from the second to the first node of each member
+    edges = nodes[members[:, 0]] - nodes[members[:, 1]]
+    columns = np.arange(len(members))
+    A = np.zeros((len(nodes), 3, len(members)))
+    A[members[:, 0], :, columns] = edges
+    A[members[:, 1], :, columns] = -edges
+    return A.reshape(3 * len(nodes), len(members))
+
+
+def force_density_matrix(node_num, members, q):
+    """Force density (stress) matrix, node num * node num, of force densities q of members"""
+    members = np.asarray(members, dtype=int)
+    omega = np.zeros((node_num, node_num))
+    np.add.at(omega, (members[:, 0], members[:, 1]), -q)
+    np.add.at(omega, (members[:, 1], members[:, 0]), -q)
+    np.add.at(omega, (members[:, 0], members[:, 0]), q)
+    np.add.at(omega, (members[:, 1], members[:, 1]), q)
+    return omega
+
+
+class EquilibriumPrefilter(object):
+    """
+    Analytic pre-screen of a tensegrity before any simulation, rejecting designs that surely fail the rollout
+
+    .. note::
+
+        By default only conditions that imply failure in this simulator are rejected: members of zero length,
+        and designs too high above the floor. A rollout is terminated once the first bar has dropped
+        `max_drop` (`healthy_z_range` of `TensegEnv`), and cables at their rest length pull nothing, so a
+        design whose lowest point is more than that above the floor falls that far before anything can hold
+        it. The clearance is taken after the worst `reset_noise` of the env, which also tilts every bar about
+        the world origin, with `margin` for its noise on velocities. On genes of `create_population` this
+        rejects about 14 % of the designs at 2 struts, 5 % at 3, 2 % at 4 and almost none from 6, in about
+        15 microseconds each, so the time saved is modest.
+
+        With `self_stress`, designs also need a self-stress: force densities q with A @ q = 0, tension
+        (q > 0) in every cable and compression (q < 0) in every bar, found by an SVD of the equilibrium matrix
+        A and a linear program, which takes milliseconds. With `super_stability`, its force density matrix also
+        has to be positive semi-definite with nullity 4. Simulated cables are slack below their rest length, so
+        designs rest stably without any self-stress, and random nodes almost never have one: these checks
+        reject nearly all decoded designs, including stable ones, and are meant for analysis, not speed.
+
+        Rejected designs get fitness 0 without a simulation, except a deterministic `audit_fraction` of them
+        that is still simulated to measure how often the pre-filter disagrees with the simulator.
+
+    """
+
+    def __init__(self, super_stability=False, tol=1e-9, audit_fraction=0.0, self_stress=False,
+                 max_drop=0.2, reset_noise=0.05, margin=0.05):
+        """
+        Args:
+            super_stability: also require a super-stable self-stress, implies `self_stress`
+            tol: relative tolerance of lengths, singular and eigenvalues
+            audit_fraction: fraction of rejected designs that are simulated anyway
+            self_stress: also require a self-stress with compressed bars and tensioned cables
+            max_drop: drop of the first bar that terminates a rollout, `-healthy_z_range[0]` of `TensegEnv`
+            reset_noise: `reset_noise_scale` of `TensegEnv`
+            margin: extra clearance in meters, for the noise of the env on velocities
+        """
+        self._super_stability = super_stability
+        self._tol = tol
+        self._audit_fraction = audit_fraction
+        self._self_stress = self_stress or super_stability
+        self._max_drop = max_drop
+        self._reset_noise = reset_noise
+        self._margin = margin
+
+    def __repr__(self):
+        return "EquilibriumPrefilter%r" % (self.params,)
+
+    @property
+    def params(self):
+        """All settings that affect the result, in the order of the arguments"""
+        return (self._super_stability, self._tol, self._audit_fraction, self._self_stress,
+                self._max_drop, self._reset_noise, self._margin)
+
+    def clearance(self, nodes):
+        """
+        Height of the lowest point of a design above the floor, after the worst reset noise
+        Args:
+            nodes: node num * 3, coordinates in the world frame, where the frames of all bars are
+
+        Returns: clearance in meters
+
+        """
+        # a unit quaternion of noise has a vector part of at most `s` per axis, which moves the height of p
+        # by at most 2 s (|x| + |y|) to first order and 2 |v|^2 |p| <= 6 s^2 |p| to second order
+        s = self._reset_noise / (1 - self._reset_noise)
+        lowest = (nodes[:, 2] - self._reset_noise - 2 * s * (np.abs(nodes[:, 0]) + np.abs(nodes[:, 1]))
+                  - 6 * s * s * np.linalg.norm(nodes, axis=1))
+        return lowest.min() - BAR_RADIUS - FLOOR_Z
+
+    def self_stress(self, nodes, bars, cables):
+        """
+        Find a self-stress with compressed bars and tensioned cables
+        Returns: force densities (bars first, scaled so that all are at least 1 in magnitude), or None
+
+        """
+        from scipy.optimize import linprog
+        A = equilibrium_matrix(nodes, bars, cables)
+        singular = np.linalg.svd(A, compute_uv=False)
+        if singular[-1] > self._tol * singular[0] and A.shape[0] >= A.shape[1]:
+            return None
+
+        # q is scale free, so strict signs are written as |q| >= 1
+        bounds = [(None, -1)] * len(bars) + [(1, None)] * len(cables)
+        result = linprog(np.zeros(A.shape[1]), A_eq=A, b_eq=np.zeros(A.shape[0]), bounds=bounds, method="highs")
+        if result.status != 0:
+            return None
+        return result.x
+
+    def is_super_stable(self, node_num, bars, cables, q):
+        """Whether the force density matrix of q is positive semi-definite with nullity 4 (in 3D)"""
+        omega = force_density_matrix(node_num, np.concatenate((bars, cables)), q)
+        eigenvalues = np.linalg.eigvalsh(omega)
+        tol = self._tol * max(np.abs(eigenvalues).max(), 1)
+        return eigenvalues[0] > -tol and np.sum(np.abs(eigenvalues) <= tol) == 4
+
+    def check(self, nodes, bars, cables):
+        """
+        Pre-screen a decoded tensegrity
+        Returns: `PrefilterResult` of whether the design may be stable, why and the self-stress found, if
+        `self_stress` is checked
+
+        """
+        members = np.concatenate((bars, cables))
+        lengths = np.linalg.norm(nodes[members[:, 0]] - nodes[members[:, 1]], axis=1)
+        if lengths.min() <= self._tol * max(lengths.max(), 1):
+            return PrefilterResult(False, "degenerate", None)
+        # the first bar drops its own reset noise further before the rollout is terminated
+        if self.clearance(nodes) > self._max_drop + self._reset_noise + self._margin:
+            return PrefilterResult(False, "free_fall", None)
+        if not self._self_stress:
+            return PrefilterResult(True, "feasible", None)
+
+        q = self.self_stress(nodes, bars, cables)
+        if q is None:
+            return PrefilterResult(False, "no_self_stress", None)
+        if self._super_stability and not self.is_super_stable(len(nodes), bars, cables, q):
+            return PrefilterResult(False, "not_super_stable", q)
+        return PrefilterResult(True, "feasible", q)
+
+    def audit(self, gene):
+        """Whether a rejected gene is simulated anyway, the same for a gene in every process"""
+        return zlib.crc32(np.ascontiguousarray(gene).tobytes()) < self._audit_fraction * 2 ** 32
@@ -0,0 +1,111 @@
+import hashlib
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+
+
+def structure_key(nodes, bars, cables, sim_params):
+    """
+    Hash a decoded tensegrity together with the parameters it is simulated with
+    Args:
+        nodes: coordinates of nodes
+        bars: pairs of bars
+        cables: pairs of cables
+        sim_params: dict of simulation parameters that affect the fitness
+
+    Returns: a hex string
+
+    """
+    digest = hashlib.sha1()
+    for array, dtype in ((nodes, '<f8'), (bars, '<i8'), (cables, '<i8')):
+        array = np.ascontiguousarray(array, dtype=dtype)
+        digest.update(repr(array.shape).encode())
+        digest.update(array.tobytes())
+    digest.update(repr(sorted(sim_params.items())).encode())
+    return digest.hexdigest()
+
+
+class FitnessCache(object):
+    """
+    Memoization of fitness values, with a bounded LRU in memory and an optional
+    persistent store (sqlite) shared by repeated runs
+    """
+
+    def __init__(self, maxsize=4096, path=None):
+        """
+        Args:
+            maxsize: max number of fitness values kept in memory
+            path: file of the persistent store. defaults to None, in memory only
+        """
+        self._maxsize = maxsize
+        self._memory = OrderedDict()
+
+        self._path = path
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS fitness (key TEXT PRIMARY KEY, value REAL)")
+            self._db.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _lookup(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if self._db is not None:
+            row = self._db.execute("SELECT value FROM fitness WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._remember(key, row[0])
+                return row[0]
+        return None
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached fitness of `key`, or None, and count the hit or miss"""
+        value = self._lookup(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Cache the fitness of `key`"""
+        self._remember(key, float(value))
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO fitness VALUES (?, ?)", (key, float(value)))
+
+    def flush(self):
+        """Commit cached values to the persistent store"""
+        if self._db is not None:
+            self._db.commit()
+
+    def snapshot(self):
+        """Keys and fitness values kept in memory, least recently used first"""
+        return np.asarray(list(self._memory.keys()), dtype=str), np.fromiter(self._memory.values(), dtype=float)
+
+    def restore(self, keys, values):
+        """Replace the values kept in memory by a `snapshot`"""
+        self._memory.clear()
+        for key, value in zip(keys, values):
+            self._remember(str(key), float(value))
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
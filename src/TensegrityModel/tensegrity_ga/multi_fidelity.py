@@ -0,0 +1,128 @@
+from collections import namedtuple
+import numpy as np
+from src.TensegrityModel.tensegrity_ga.stability import StabilityEvaluator
+
+# timestep, integrator and solver iterations of the reference simulation, the defaults of `Tensegrity`
+REFERENCE_TIMESTEP = 0.002
+REFERENCE_INTEGRATOR = "RK4"
+REFERENCE_ITERATIONS = 100
+
+FidelityLevel = namedtuple('FidelityLevel', ['max_steps', 'timestep', 'integrator', 'iterations'],
+                           defaults=(REFERENCE_TIMESTEP, REFERENCE_INTEGRATOR, REFERENCE_ITERATIONS))
+
+
+class SuccessiveHalving(object):
+    """
+    Multi-fidelity evaluation of a generation, where only the best designs of a cheap rollout are promoted
+    to a longer and more accurate one
+
+    .. note::
+
+        `levels` are the `Tensegrity` options (timestep, integrator, solver iterations) and horizon of the
+        rungs below the reference fidelity of the GA, cheapest first. Every design is simulated at the first
+        rung, then the best `1 / eta` of the stable ones are promoted to the next rung, up to the reference
+        rollout. Designs eliminated at a rung keep their fitness at that rung, and unstable designs are never
+        promoted, so a design only stable at a higher fidelity is lost. Eliminated designs that outrank every
+        reference value are then simulated at the reference fidelity, until the best design has a reference
+        value, so a cheap score never becomes the best of a generation. Only reference values are cached.
+
+        The stability checks of a rung keep the simulated time of the reference ones, e.g. `min_steps` is
+        divided by 5 for a timestep 5 times the reference one. A rung with the reference timestep and integrator
+        and a shorter horizon repeats the start of the reference rollout, so it never loses a stable design.
+        Another timestep or integrator changes the outcome of some designs, which rest on slack cables.
+
+    """
+
+    def __init__(self, levels=None, eta=2):
+        """
+        Args:
+            levels: `FidelityLevel` of each rung below the reference, cheapest first. defaults to the first
+            200 steps of the reference simulation
+            eta: 1 / fraction of the designs promoted from a rung to the next one
+        """
+        if levels is None:
+            levels = [FidelityLevel(200)]
+        self._levels = [FidelityLevel(*level) for level in levels]
+        self._eta = eta
+        self.evaluations = [0] * (len(self._levels) + 1)
+
+    def __repr__(self):
+        return "SuccessiveHalving%r" % (self.params,)
+
+    @property
+    def params(self):
+        """All settings that affect the result"""
+        return (tuple(self._levels), self._eta)
+
+    @property
+    def levels(self):
+        return list(self._levels)
+
+    def stability(self, stability, level):
+        """
+        Stability test at a rung
+        Args:
+            stability: `StabilityEvaluator` of the reference fidelity
+            level: index of the rung in `levels`
+
+        Returns: `StabilityEvaluator` with the horizon of the rung and checks scaled to its timestep
+
+        """
+        fidelity = self._levels[level]
+        scale = REFERENCE_TIMESTEP / fidelity.timestep
+        max_steps, min_steps, window = stability.params[:3]
+        return StabilityEvaluator(
+            fidelity.max_steps,
+            min(max(int(round(min_steps * scale)), 1), fidelity.max_steps),
+            min(max(int(round(window * scale)), 1), fidelity.max_steps),
+            *stability.params[3:],
+        )
+
+    def run(self, size, evaluate, maximize=True):
+        """
+        Evaluate `size` designs rung by rung
+        Args:
+            size: number of designs
+            evaluate: function of the positions of designs and a rung, the index of `levels` or `len(levels)`
+            for the reference, returning their fitness
+            maximize: whether a higher fitness is better
+
+        Returns: fitness of every design, and the rung each of them reached
+
+        """
+        fitness = np.zeros(size)
+        reached = np.zeros(size, dtype=int)
+        alive = np.arange(size)
+        for level in range(len(self._levels) + 1):
+            if not len(alive):
+                break
+            fitness[alive] = evaluate(alive, level)
+            reached[alive] = level
+            self.evaluations[level] += len(alive)
+            if level == len(self._levels):
+                break
+
+            # the best of the stable designs, in their original order
+            order = alive[np.argsort(-fitness[alive] if maximize else fitness[alive], kind='stable')]
+            promoted = order[:int(np.ceil(len(alive) / self._eta))]
+            alive = np.sort(promoted[fitness[promoted] != 0])
+
+        # stable designs of cheaper rungs ranked above the best reference value go straight to the reference
+        reference = len(self._levels)
+        while True:
+            checked = fitness[reached == reference]
+            unchecked = np.flatnonzero((reached != reference) & (fitness != 0))
+            if len(checked):
+                best = checked.max() if maximize else checked.min()
+                unchecked = unchecked[fitness[unchecked] > best if maximize else fitness[unchecked] < best]
+            if not len(unchecked):
+                break
+            fitness[unchecked] = evaluate(unchecked, reference)
+            reached[unchecked] = reference
+            self.evaluations[reference] += len(unchecked)
+        return fitness, reached
+
+    @property
+    def stats(self):
+        """Number of rollouts at each rung so far, the reference last"""
+        return list(self.evaluations)
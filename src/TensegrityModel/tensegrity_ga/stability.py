@@ -0,0 +1,117 @@
+from collections import namedtuple
+import numpy as np
+import mujoco
+
+StabilityResult = namedtuple('StabilityResult', ['stable', 'steps', 'reason'])
+
+
+class StabilityEvaluator(object):
+    """
+    Stability test of a tensegrity by a rollout with zero action, which stops as soon as the design
+    is confidently settled or confidently unstable instead of always running `max_steps`
+
+    .. note::
+
+        Every `window` steps the kinetic energy, the largest velocity of bars and the drift of `qpos`
+        over the window are checked. The design is settled when all of them stay under their tolerances
+        for `patience` consecutive windows, and unstable when the energy or velocity stays above the
+        divergence limits for `patience` consecutive windows, or when the env terminates.
+
+    """
+
+    def __init__(
+            self,
+            max_steps=1000,
+            min_steps=100,
+            window=50,
+            patience=2,
+            energy_tol=1e-5,
+            velocity_tol=1e-2,
+            drift_tol=5e-3,
+            unstable_energy=1e6,
+            unstable_velocity=1e3,
+            early_exit=True,
+    ):
+        """
+        Args:
+            max_steps: max number of env steps of the rollout
+            min_steps: the design is never considered settled before this step
+            window: number of env steps between two checks
+            patience: number of consecutive checks needed for a decision
+            energy_tol: kinetic energy under which the design may be settled
+            velocity_tol: max abs of `qvel` under which the design may be settled
+            drift_tol: max abs change of `qpos` over a window under which the design may be settled
+            unstable_energy: kinetic energy over which the design is diverging
+            unstable_velocity: max abs of `qvel` over which the design is diverging
+            early_exit: False to always run `max_steps` unless terminated, as a fixed-horizon reference
+        """
+        self._max_steps = max_steps
+        self._min_steps = min_steps
+        self._window = window
+        self._patience = patience
+        self._energy_tol = energy_tol
+        self._velocity_tol = velocity_tol
+        self._drift_tol = drift_tol
+        self._unstable_energy = unstable_energy
+        self._unstable_velocity = unstable_velocity
+        self._early_exit = early_exit
+
+    def __repr__(self):
+        return "StabilityEvaluator%r" % (self.params,)
+
+    @property
+    def params(self):
+        """All settings that affect the result"""
+        return (self._max_steps, self._min_steps, self._window, self._patience,
+                self._energy_tol, self._velocity_tol, self._drift_tol,
+                self._unstable_energy, self._unstable_velocity, self._early_exit)
+
+    @property
+    def max_steps(self):
+        return self._max_steps
+
+    def rollout(self, env):
+        """
+        Step the (reset) env with zero action until the stability of the design is decided
+        Args:
+            env: `TensegEnv`, possibly wrapped
+
+        Returns: `StabilityResult` of whether the design is stable, the number of steps used and why it stopped
+
+        """
+        model, data = env.unwrapped.model, env.unwrapped.data
+        action = np.zeros(env.action_space.shape)
+        momentum = np.empty(model.nv)
+        reference = data.qpos.copy()
+        settled = diverged = 0
+
+        for step in range(1, self._max_steps + 1):
+            observation, reward, terminated, truncated, info = env.step(action)
+            if terminated:
+                return StabilityResult(False, step, "terminated")
+            if not self._early_exit or step % self._window:
+                continue
+
+            mujoco.mj_mulM(model, data, momentum, data.qvel)
+            energy = .5 * np.dot(data.qvel, momentum)
+            velocity = np.abs(data.qvel).max()
+            drift = np.abs(data.qpos - reference).max()
+            reference[:] = data.qpos
+
+            # written so that nan counts as diverging
+            if not (energy <= self._unstable_energy and velocity <= self._unstable_velocity):
+                diverged += 1
+            else:
+                diverged = 0
+            if diverged >= self._patience:
+                return StabilityResult(False, step, "diverged")
+
+            if (step >= self._min_steps and energy < self._energy_tol
+                    and velocity < self._velocity_tol and drift < self._drift_tol):
+                settled += 1
+            else:
+                settled = 0
+            if settled >= self._patience:
+                return StabilityResult(True, step, "settled")
+
+        return StabilityResult(True, self._max_steps, "max_steps")
@@ -0,0 +1,199 @@
+from collections import deque
+import numpy as np
+
+
+def structural_features(nodes, bars, cables):
+    """
+    Features of a decoded tensegrity for the surrogate
+    Returns: vector of hull volume, bar and cable length statistics, extents, height, node degrees and
+    the number of nodes without cables
+
+    """
+    from scipy.spatial import ConvexHull, QhullError
+    bar_lengths = np.linalg.norm(nodes[bars[:, 0]] - nodes[bars[:, 1]], axis=1)
+    cable_lengths = np.linalg.norm(nodes[cables[:, 0]] - nodes[cables[:, 1]], axis=1)
+    try:
+        volume = ConvexHull(nodes).volume
+    except (QhullError, ValueError):
+        volume = 0.
+    extent = nodes.max(axis=0) - nodes.min(axis=0)
+    degree = np.bincount(cables.ravel(), minlength=len(nodes))
+    return np.array([
+        volume,
+        bar_lengths.mean(), bar_lengths.min(), bar_lengths.max(),
+        cable_lengths.mean(), cable_lengths.min(), cable_lengths.max(), cable_lengths.std(),
+        cable_lengths.mean() / max(bar_lengths.mean(), 1e-9),
+        extent[0], extent[1], extent[2],
+        nodes[:, 2].min(), nodes[:, 2].mean(),
+        degree.min(), degree.max(), degree.std(),
+        np.sum(degree == 0),
+    ])
+
+
+class SurrogateModel(object):
+    """
+    Online ridge regression of stability from structural features, to only simulate promising designs
+
+    .. note::
+
+        Fitness is the hull volume of stable designs, so the surrogate predicts the probability of being stable,
+        by least squares on 0/1 labels, and ranks designs by that probability times the hull volume. It learns
+        from the sufficient statistics of all simulated designs, so an update costs the same at any size.
+
+        Until `min_samples` designs are simulated, everything is simulated. Then only the top `fraction` of the
+        designs of a generation by predicted fitness, plus an `exploration` fraction of the others at random, are
+        simulated; the others get fitness 0 and are not cached. Predictions are compared to simulated results
+        before learning from them.
+
+    """
+
+    def __init__(self, fraction=0.5, exploration=0.1, ridge=1e-3, min_samples=40, window=256):
+        """
+        Args:
+            fraction: fraction of designs simulated, by predicted fitness
+            exploration: fraction of the other designs simulated anyway
+            ridge: L2 regularization of the regression
+            min_samples: number of simulated designs before any is skipped
+            window: number of recent predictions giving the threshold of designs bred one at a time
+        """
+        self._fraction = fraction
+        self._exploration = exploration
+        self._ridge = ridge
+        self._min_samples = min_samples
+
+        self._gram = None
+        self._moment = None
+        self._weights = None
+        self._recent = deque(maxlen=window)
+
+        self.samples = 0
+        self.simulated = 0
+        self.skipped = 0
+        self._abs_error = 0.
+        self._correct = 0
+        self._checked = 0
+
+    def __repr__(self):
+        return "SurrogateModel%r" % (self.params,)
+
+    @property
+    def params(self):
+        """All settings that affect the result"""
+        return (self._fraction, self._exploration, self._ridge, self._min_samples, self._recent.maxlen)
+
+    @property
+    def trained(self):
+        return self.samples >= self._min_samples
+
+    @staticmethod
+    def _design_matrix(features):
+        features = np.atleast_2d(features)
+        return np.column_stack((np.ones(len(features)), features))
+
+    def predict_stable(self, features):
+        """Predicted probability of each design to be stable"""
+        if self._weights is None:
+            return np.full(len(np.atleast_2d(features)), .5)
+        return np.clip(self._design_matrix(features) @ self._weights, 0, 1)
+
+    def predict(self, features):
+        """Predicted fitness of each design"""
+        return self.predict_stable(features) * np.atleast_2d(features)[:, 0]
+
+    def update(self, features, fitness):
+        """Learn from simulated designs, after comparing the predictions with the results"""
+        features = np.atleast_2d(features)
+        fitness = np.asarray(fitness, dtype=float)
+        stable = (fitness > 0).astype(float)
+        if self.trained:
+            self._abs_error += np.abs(self.predict(features) - fitness).sum()
+            self._correct += np.sum((self.predict_stable(features) > .5) == stable)
+            self._checked += len(fitness)
+
+        X = self._design_matrix(features)
+        if self._gram is None:
+            self._gram = np.zeros((X.shape[1], X.shape[1]))
+            self._moment = np.zeros(X.shape[1])
+        self._gram += X.T @ X
+        self._moment += X.T @ stable
+        self.samples += len(fitness)
+
+        penalty = self._ridge * np.eye(X.shape[1]) * max(np.trace(self._gram) / X.shape[1], 1)
+        penalty[0, 0] = 0
+        self._weights = np.linalg.lstsq(self._gram + penalty, self._moment, rcond=None)[0]
+
+    def select(self, features, rng, keep=None):
+        """
+        Choose the designs of a generation to simulate
+        Args:
+            features: features of the designs, one row per design
+            rng: `numpy.random.Generator` of the exploration
+            keep: boolean mask of designs simulated in any case, e.g. the elite. defaults to None
+
+        Returns: boolean mask of the designs to simulate
+
+        """
+        size = len(features)
+        if not self.trained or not size:
+            self.simulated += size
+            return np.ones(size, dtype=bool)
+
+        predicted = self.predict(features)
+        self._recent.extend(predicted)
+        chosen = np.zeros(size, dtype=bool)
+        chosen[np.argsort(-predicted, kind='stable')[:int(np.ceil(self._fraction * size))]] = True
+        chosen |= ~chosen & (rng.random(size) < self._exploration)
+        if keep is not None:
+            chosen |= keep
+        self.simulated += chosen.sum()
+        self.skipped += size - chosen.sum()
+        return chosen
+
+    def accept(self, features, rng):
+        """Whether to simulate a single design, against the predictions of recent designs"""
+        if not self.trained:
+            self.simulated += 1
+            return True
+        predicted = self.predict(features)[0]
+        threshold = np.quantile(self._recent, 1 - self._fraction) if self._recent else -np.inf
+        self._recent.append(predicted)
+        accepted = predicted >= threshold or rng.random() < self._exploration
+        self.simulated += accepted
+        self.skipped += not accepted
+        return bool(accepted)
+
+    def get_state(self):
+        """Learned statistics and counters, as arrays and numbers, for checkpoints"""
+        arrays = dict(recent=np.asarray(self._recent, dtype=float))
+        if self._gram is not None:
+            arrays.update(gram=self._gram, moment=self._moment, weights=self._weights)
+        counters = dict(samples=int(self.samples), simulated=int(self.simulated), skipped=int(self.skipped),
+                        abs_error=float(self._abs_error), correct=int(self._correct), checked=int(self._checked))
+        return arrays, counters
+
+    def set_state(self, arrays, counters):
+        """Restore the result of `get_state`"""
+        self._gram = np.array(arrays["gram"]) if "gram" in arrays else None
+        self._moment = np.array(arrays["moment"]) if "moment" in arrays else None
+        self._weights = np.array(arrays["weights"]) if "weights" in arrays else None
+        self._recent.clear()
+        self._recent.extend(float(value) for value in arrays["recent"])
+        self.samples = counters["samples"]
+        self.simulated = counters["simulated"]
+        self.skipped = counters["skipped"]
+        self._abs_error = counters["abs_error"]
+        self._correct = counters["correct"]
+        self._checked = counters["checked"]
+
+    @property
+    def stats(self):
+        """Simulated and skipped designs, and the mean absolute error of predicted fitness and the accuracy of
+        predicted stability over the designs simulated once trained
+        """
+        return dict(
+            samples=self.samples,
+            simulated=int(self.simulated),
+            skipped=int(self.skipped),
+            fitness_mae=float(self._abs_error / self._checked) if self._checked else None,
+            stability_accuracy=float(self._correct / self._checked) if self._checked else None,
+        )
@@ -0,0 +1,119 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer(object):
+    """Accumulate wall time of named phases"""
+
+    def __init__(self):
+        self.phases = {}
+        self.start = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+
+class GAObserver(object):
+    """
+    Observer of a `TensegrityGA` run, attached by `TensegrityGA(observers=...)` or `add_observer`.
+    Override any of the callbacks, all of them do nothing by default.
+
+    .. note::
+
+        Evaluation records have the keys `generation`, `index` (in the population, in steady-state mode the rank
+        the child took in the population, or None if it was not inserted), `fitness`, `stable`,
+        `steps`, `reason`, `worker`, `start`, `end` (epoch seconds), `phases` (seconds of decode, prefilter,
+        build, xml with `from_xml`, rollout and bounding_box), `prefilter` (the reason of the
+        `EquilibriumPrefilter` decision, or None) and `fidelity` (the rung of `SuccessiveHalving`, or None).
+
+        Generation records have the keys `generation`, `best_fitness`, `mean_fitness`, `evaluations`,
+        `cache_hits`, `cache_misses`, `steps`, `max_steps`, `prefilter` (counts of `prefilter_stats` so far,
+        or None), `diversity` (fraction of distinct canonical designs, or None), `surrogate` (counts and
+        prediction errors of `surrogate_stats` so far, or None), `fidelity` (rollouts per rung of
+        `fidelity_stats` so far, or None), `phases` (seconds of the GA phases of the generation),
+        `evaluation_phases` (seconds summed over evaluations), `workers`, `evaluation_wall`, `worker_utilization`
+        (busy time / (wall * workers)) and `straggler_time` (seconds at the end of the evaluation with at least
+        one worker idle).
+
+    """
+
+    def on_run_start(self, ga):
+        pass
+
+    def on_evaluation(self, ga, record):
+        pass
+
+    def on_generation(self, ga, record):
+        pass
+
+    def on_run_end(self, ga):
+        pass
+
+
+class ConsolePrinter(GAObserver):
+    """Print the progress of every generation, used when the GA is verbose"""
+
+    def on_generation(self, ga, record):
+        print("Fitness: %f" % record["best_fitness"])
+        if record["cache_hits"] is not None:
+            print("Cache: %d hits, %d misses" % (record["cache_hits"], record["cache_misses"]))
+        print("Steps: %d of max %d" % (record["steps"], record["max_steps"]))
+        if record["diversity"] is not None:
+            print("Diversity: %.2f" % record["diversity"])
+        if record["prefilter"] is not None:
+            print("Prefilter: %(rejected)d rejected, %(audited)d audited, %(false_rejects)d false rejects, "
+                  "%(false_accepts)d false accepts" % record["prefilter"])
+        if record["surrogate"] is not None and record["surrogate"]["fitness_mae"] is not None:
+            print("Surrogate: %(simulated)d simulated, %(skipped)d skipped, fitness error %(fitness_mae).4f, "
+                  "stability accuracy %(stability_accuracy).2f" % record["surrogate"])
+        if record["fidelity"] is not None:
+            print("Fidelity: %s rollouts per rung" % " / ".join(str(count) for count in record["fidelity"]))
+        if record["evaluations"]:
+            print("Time: %.2fs, evaluation %.2fs, utilization %.0f%%, straggler %.2fs" % (
+                sum(record["phases"].values()), record["evaluation_wall"],
+                100 * record["worker_utilization"], record["straggler_time"]))
+
+
+class JsonLinesLogger(GAObserver):
+    """Write every evaluation and generation record as a line of JSON"""
+
+    def __init__(self, path, evaluations=True):
+        """
+        Args:
+            path: file of the log, appended to
+            evaluations: False to log generation records only
+        """
+        self._path = path
+        self._evaluations = evaluations
+        self._file = None
+
+    def _write(self, event, record):
+        if self._file is None:
+            self._file = open(self._path, 'a')
+        self._file.write(json.dumps(dict(record, event=event), default=float) + "\n")
+
+    def on_run_start(self, ga):
+        self._write("run_start", {"time": time.time()})
+
+    def on_evaluation(self, ga, record):
+        if self._evaluations:
+            self._write("evaluation", record)
+
+    def on_generation(self, ga, record):
+        self._write("generation", record)
+        self._file.flush()
+
+    def on_run_end(self, ga):
+        self._write("run_end", {"time": time.time()})
+        self._file.close()
+        self._file = None
@@ -1,33 +1,57 @@
-import random
+import multiprocessing as mp
+import os
+import threading
+import time
+import warnings
 import numpy as np
-from operator import attrgetter
-import copy
 from concurrent import futures
 from src.TensegrityModel.tensegrity_builder import Tensegrity
-from scipy.spatial import ConvexHull
+from src.TensegrityModel.model_cache import TopologyModelCache
+from src.TensegrityModel.mjb_cache import CompiledModelCache
+from src.TensegrityModel.recorder import TrajectoryRecorder
+from src.TensegrityModel.tensegrity_ga.fitness_cache import FitnessCache, structure_key
+from src.TensegrityModel.tensegrity_ga.stability import StabilityEvaluator, StabilityResult
+from src.TensegrityModel.tensegrity_ga.telemetry import PhaseTimer, ConsolePrinter, JsonLinesLogger
+from src.TensegrityModel.tensegrity_ga.checkpoint import Checkpointer, load_checkpoint
+from src.TensegrityModel.tensegrity_ga.canonical import Canonicalizer
+from src.TensegrityModel.tensegrity_ga.equilibrium import EquilibriumPrefilter
+from src.TensegrityModel.tensegrity_ga.surrogate import structural_features
+from src.TensegrityModel.tensegrity_ga.multi_fidelity import SuccessiveHalving, FidelityLevel
 
 
-def bounding_box(vertices):
-    """Calculate 3D minimal bounding box volume of a tensegrity"""
-    hull = ConvexHull(vertices)
-    return hull.volume
+# modules the fork server of parallel_type="forkserver" imports once, before forking every worker from itself
+FORKSERVER_PRELOAD = [
+    "numpy",
+    "mujoco",
+    "scipy.spatial",
+    "src.TensegrityModel.envs.tensegrity_gym",
+    "src.TensegrityModel.tensegrity_ga.tensegrity_ga",
+]
 
+# the GA a worker process evaluates with, set once by the pool initializer
+_worker_ga = None
 
-class Chromosome(object):
-    """
-    Chromosome class that encapsulates an individual's fitness and solution
-    representation.
-    """
 
-    def __init__(self, genes):
-        """Initialise the Chromosome"""
-        self.genes = genes
-        self.fitness = 0
+def _init_worker(ga):
+    global _worker_ga
+    _worker_ga = ga
 
-    def __repr__(self):
-        """Return initialised Chromosome representation in readable form.
-        """
-        return repr((self.fitness, self.genes))
+
+def _evaluate_in_worker(index, gene, level=None):
+    return index, _worker_ga._evaluate_timed(gene, level)
+
+
+def _pool_type(parallel_type):
+    """"process" or "thread", the kind of workers of a `parallel_type`"""
+    parallel_type = parallel_type.lower()
+    return "process" if "process" in parallel_type or parallel_type == "forkserver" else "thread"
+
+
+def bounding_box(vertices):
+    """Calculate 3D minimal bounding box volume of a tensegrity"""
+    from scipy.spatial import ConvexHull
+    hull = ConvexHull(vertices)
+    return hull.volume
 
 
 class TensegrityGA(object):
@@ -44,6 +68,22 @@ class TensegrityGA(object):
             random_state=None,
             gym_des=None,
             dirname=None,
+            from_xml=False,
+            eval_seed=0,
+            stability=None,
+            cache_size=4096,
+            cache_path=None,
+            observers=None,
+            log_path=None,
+            checkpoint_dir=None,
+            checkpoint_every=1,
+            prefilter=None,
+            canonical=None,
+            model_cache_size=64,
+            record_dir=None,
+            surrogate=None,
+            multi_fidelity=None,
+            compiled_cache_dir=None,
     ):
         """
         Args:
@@ -51,9 +91,34 @@ class TensegrityGA(object):
             population_size: number of candidate solutions in each generation
             generations: number of generations to evolve
             random_state: random seed. defaults to None
-            gym_des: destination folder of 'asset' in Gymnasium package,
-            usually `/home/$username$/anaconda3/envs/gym/lib/python3.8/site-packages/gymnasium/envs/mujoco/assets`
-            dirname: where to store .xml, just use osp.dirname(__file__)
+            gym_des: deprecated, its value is ignored and any value other than None means `from_xml=True`
+            dirname: parent of the scratch directories of xml files, defaults to the temporary directory of the
+            system. only used together with `from_xml`
+            from_xml: load designs from xml files, each written to a private scratch directory, see
+            `Tensegrity.make_env_from_xml`. defaults to False, where designs are compiled and simulated in memory
+            eval_seed: seed of the reset noise in every simulation, which makes fitness deterministic
+            stability: `StabilityEvaluator` deciding whether a design is stable. defaults to early exit
+            within 1000 steps
+            cache_size: max number of fitness values memoized in memory, 0 to disable the cache
+            cache_path: file for persisting memoized fitness across runs. defaults to None
+            observers: list of `GAObserver` receiving evaluation and generation records
+            log_path: file for a JSON lines log of all records. defaults to None
+            checkpoint_dir: directory of checkpoints and of the generation history. defaults to None
+            checkpoint_every: number of generations between checkpoints
+            prefilter: `EquilibriumPrefilter` giving fitness 0 without simulation to designs that surely
+            fail the rollout. defaults to None
+            canonical: `Canonicalizer` whose keys replace exact structure keys in the fitness cache, so that
+            designs equal up to relabeling, and pose with its `invariance`, are only simulated once. defaults to None
+            model_cache_size: max number of compiled topologies whose models are reused for designs that only
+            differ in node coordinates, 0 to compile every design
+            record_dir: directory where the states of every stability rollout are recorded, in a subdirectory
+            per process and thread, see `TrajectoryReader`. defaults to None
+            surrogate: `SurrogateModel` learning from simulated designs which new designs are worth simulating,
+            the others get fitness 0. defaults to None
+            multi_fidelity: `SuccessiveHalving` evaluating a generation with cheap rollouts first and only
+            promoting the best designs to the reference rollout. defaults to None
+            compiled_cache_dir: directory of a `CompiledModelCache` shared by all workers and runs, from which
+            designs compiled before are loaded instead of compiled. defaults to None
         """
 
         self._strut_num = strut_num
@@ -68,6 +133,8 @@ class TensegrityGA(object):
             self._links[2 * i + 1][1] = (i + 2) % self._node_num
         self._struts = np.asarray([4 * i for i in range(self._strut_num)], dtype=int)
         self._cables = np.delete(np.arange(self._link_num), self._struts)
+        # gene: coordinates of nodes followed by 8 * strut_num shuffles of (link1, link2, node1, node2)
+        self._gene_len = 3 * self._node_num + 4 * 8 * self._strut_num
 
         self._population_size = population_size
         self._generations = generations
@@ -76,45 +143,116 @@ class TensegrityGA(object):
         self._crossover_probability = 1 - self._mutation_probability
         self._elitism = elitism
 
-        self._current_generation = []
+        # population as structure of arrays, one gene per row
+        self._genes = np.empty(shape=(0, self._gene_len))
+        self._fitness = np.empty(shape=0)
 
         self._maximize_fitness = maximize_fitness
 
         self._verbose = verbose
-        self._random = random.Random(random_state)
+        self._rng = np.random.default_rng(random_state)
 
-        self._gym_des = gym_des
+        if gym_des is not None:
+            warnings.warn("gym_des is deprecated and its value is ignored, use from_xml=True",
+                          DeprecationWarning, stacklevel=2)
+            from_xml = True
+        self._from_xml = from_xml
         self._dirname = dirname
 
+        self._stability = stability if stability is not None else StabilityEvaluator(max_steps=1000)
+        self._prefilter = prefilter
+        self._prefilter_stats = dict(checked=0, rejected=0, audited=0, false_rejects=0, false_accepts=0)
+
+        # everything the fitness of a decoded tensegrity depends on
+        self._sim_params = dict(
+            solver="Newton",
+            integrator="RK4",
+            stiffness=1,
+            damping=.05,
+            seed=eval_seed,
+            stability=self._stability.params,
+            prefilter=prefilter.params if prefilter is not None else None,
+        )
+
+        self._canonical = canonical
+        self._surrogate = surrogate
+        self._multi_fidelity = multi_fidelity
+        # each worker process gets an empty cache of its own
+        self._model_cache = TopologyModelCache(model_cache_size) if model_cache_size else None
+        self._compiled_cache = CompiledModelCache(compiled_cache_dir) if compiled_cache_dir is not None else None
+        self._record_dir = record_dir
+        self._recorders = {}
+        self._cache = None
+        if cache_size or cache_path is not None:
+            self._cache = FitnessCache(maxsize=cache_size, path=cache_path)
+        self._cache_stats = (0, 0)
+        self._steps_stats = (0, 0)
+
+        self._pool = None
+        self._pool_type = None
+        self._n_workers = 1
+
+        self._generation = 0
+        self._eval_stats = None
+        self._observers = list(observers) if observers is not None else []
+        if verbose:
+            self._observers.append(ConsolePrinter())
+        if log_path is not None:
+            self._observers.append(JsonLinesLogger(log_path))
+        self._checkpoint_dir = checkpoint_dir
+        if checkpoint_dir is not None:
+            self._observers.append(Checkpointer(checkpoint_dir, every=checkpoint_every))
+
+    def __getstate__(self):
+        # the cache, the pool and observers stay in the main process
+        state = self.__dict__.copy()
+        state['_cache'] = None
+        state['_pool'] = None
+        state['_observers'] = []
+        state['_recorders'] = {}
+        return state
+
+    def add_observer(self, observer):
+        """Attach a `GAObserver`"""
+        self._observers.append(observer)
+
+    def _notify(self, event, *args):
+        for observer in self._observers:
+            getattr(observer, event)(self, *args)
+
+    def _recorder(self):
+        """Recorder of the calling process and thread, which never share one"""
+        name = "%d-%s" % (os.getpid(), threading.current_thread().name)
+        if name not in self._recorders:
+            self._recorders[name] = TrajectoryRecorder(os.path.join(self._record_dir, name))
+        return self._recorders[name]
+
+    def _close_recorders(self):
+        for recorder in self._recorders.values():
+            recorder.close()
+        self._recorders = {}
+
+    def _sample_links(self, links, size, count):
+        """Sample `count` pairs of distinct links for each of `size` individuals"""
+        first = self._rng.integers(len(links), size=(size, count))
+        second = (first + self._rng.integers(1, len(links), size=(size, count))) % len(links)
+        return links[np.stack((first, second), axis=-1)]
+
+    def create_population(self, size):
+        """Create `size` random genes at once, one gene per row"""
+        genes = np.empty(shape=(size, self._gene_len))
+        genes[:, :3 * self._node_num] = self._rng.random((size, 3 * self._node_num))
+
+        shuffles = np.empty(shape=(size, 8 * self._strut_num, 4), dtype=int)
+        shuffles[:, :2 * self._strut_num, :2] = self._sample_links(self._struts, size, 2 * self._strut_num)
+        shuffles[:, 2 * self._strut_num:, :2] = self._sample_links(self._cables, size, 2 * self._cable_num)
+        shuffles[:, :, 2:] = self._rng.integers(0, 2, size=(size, 8 * self._strut_num, 2))
+        genes[:, 3 * self._node_num:] = shuffles.reshape(size, -1)
+
+        return genes
+
     def create_individual(self):
-        x = np.random.rand(self._node_num)
-        y = np.random.rand(self._node_num)
-        z = np.random.rand(self._node_num)
-        gene = np.column_stack((x, y, z)).flatten()
-
-        for _ in range(2 * self._strut_num):
-            random_i = self._random.sample(range(self._strut_num), 2)
-            strut_chosen = np.asarray([self._struts[i] for i in random_i])
-            gene = np.append(gene, strut_chosen).flatten()
-            random_node_1 = self._random.randint(0, 1)
-            random_node_2 = self._random.randint(0, 1)
-            # node_chosen = np.array([self._links[strut_chosen[0]][random_node_1],
-            #                         self._links[strut_chosen[1]][random_node_2]])
-            node_chosen = np.asarray([random_node_1, random_node_2], dtype=int)
-            gene = np.append(gene, node_chosen).flatten()
-
-        for _ in range(2 * self._cable_num):
-            random_i = self._random.sample(range(self._cable_num), 2)
-            cable_chosen = np.asarray([self._cables[i] for i in random_i])
-            gene = np.append(gene, cable_chosen).flatten()
-            random_node_1 = self._random.randint(0, 1)
-            random_node_2 = self._random.randint(0, 1)
-            # node_chosen = np.array([self._links[cable_chosen[0]][random_node_1],
-            #                         self._links[cable_chosen[1]][random_node_2]])
-            node_chosen = np.asarray([random_node_1, random_node_2], dtype=int)
-            gene = np.append(gene, node_chosen).flatten()
-
-        return gene
+        return self.create_population(1)[0]
 
     def decode(self, gene):
         """
@@ -141,173 +279,735 @@ class TensegrityGA(object):
 
         return nodes, bars, cables, actuators
 
+    def decode_batch(self, genes):
+        """
+        Decode a whole population of genes at once, the same as `decode` on each gene
+        Args:
+            genes: genes of the population, one gene per row
+
+        Returns: nodes (population * node num * 3), bars (population * bar num * 2),
+        cables (population * cable num * 2), actuators(cable num, default all cables)
+
+        """
+        genes = np.atleast_2d(genes)
+        size = len(genes)
+        nodes = genes[:, :self._node_num * 3].reshape(size, self._node_num, 3)
+
+        shuffles = genes[:, self._node_num * 3:].reshape(size, 8 * self._strut_num, 4).astype(int)
+        links = np.repeat(self._links[np.newaxis], size, axis=0)
+        rows = np.arange(size)
+        # shuffles have to be applied in order, but each one is applied to all individuals at once
+        for link1, link2, node1, node2 in shuffles.transpose(1, 2, 0):
+            end1 = links[rows, link1, node1]
+            end2 = links[rows, link2, node2]
+            swap = (links[rows, link1, 1 - node1] != end2) & (links[rows, link2, 1 - node2] != end1)
+            links[rows[swap], link1[swap], node1[swap]] = end2[swap]
+            links[rows[swap], link2[swap], node2[swap]] = end1[swap]
+        bars = links[:, self._struts]
+        cables = links[:, self._cables]
+        actuators = np.arange(self._cable_num)
+
+        return nodes, bars, cables, actuators
+
+    def _evaluate_timed(self, gene, level=None):
+        """`evaluate` with the wall time of each phase and where it ran, at a rung of `multi_fidelity`
+           if `level` is below the number of its levels
+        """
+        timer = PhaseTimer()
+
+        def timing(verdict=None):
+            return {
+                "worker": "%d/%s" % (os.getpid(), threading.current_thread().name),
+                "start": timer.start,
+                "end": time.time(),
+                "phases": timer.phases,
+                "prefilter": verdict.reason if verdict is not None else None,
+                "fidelity": level,
+            }
+
+        with timer.phase("decode"):
+            nodes, bars, cables, actuators = self.decode(gene)
+
+        verdict = None
+        # promoted designs already passed the pre-filter at the first rung
+        if self._prefilter is not None and not level:
+            with timer.phase("prefilter"):
+                verdict = self._prefilter.check(nodes, bars, cables)
+            if not verdict.feasible and not self._prefilter.audit(gene):
+                return 0, StabilityResult(False, 0, "prefilter"), timing(verdict)
+
+        stability = self._stability
+        options = dict(integrator=self._sim_params["integrator"])
+        if level is not None and level < len(self._multi_fidelity.levels):
+            fidelity = self._multi_fidelity.levels[level]
+            stability = self._multi_fidelity.stability(self._stability, level)
+            options = dict(integrator=fidelity.integrator, timestep=fidelity.timestep, iterations=fidelity.iterations)
+
+        with timer.phase("build"):
+            temp = Tensegrity('temp', nodes, bars, cables, actuators,
+                              solver=self._sim_params["solver"],
+                              stiffness=self._sim_params["stiffness"], damping=self._sim_params["damping"],
+                              **options)
+        recorder = self._recorder() if self._record_dir is not None else None
+        # observations and info are not used by the rollout
+        env_options = dict(reuse_obs_buffer=True, verbose_info=False)
+        if recorder is not None:
+            env_options.update(recorder=recorder, record_metadata={
+                "design": structure_key(nodes, bars, cables, self._sim_params), "fidelity": level})
+        if not self._from_xml:
+            with timer.phase("build"):
+                env = temp.make_env(model_cache=self._model_cache, compiled_cache=self._compiled_cache, **env_options)
+        else:
+            with timer.phase("xml"):
+                env = temp.make_env_from_xml(self._dirname, compiled_cache=self._compiled_cache, **env_options)
+
+        with timer.phase("rollout"):
+            env.reset(seed=self._sim_params["seed"])
+            result = stability.rollout(env)
+            if recorder is not None:
+                recorder.end_episode(stable=result.stable, steps=result.steps, reason=result.reason)
+            env.close()
+
+        fitness = 0
+        if result.stable:
+            with timer.phase("bounding_box"):
+                fitness = bounding_box(nodes)
+
+        return fitness, result, timing(verdict)
+
+    def evaluate(self, gene):
+        """
+        Simulate the tensegrity of a gene
+        Args:
+            gene:
+
+        Returns: fitness, `StabilityResult` of the rollout
+
+        """
+        fitness, result, _ = self._evaluate_timed(gene)
+        return fitness, result
+
     def fitness(self, gene):
         """Temporarily volume of the tensegrity"""
-        nodes, bars, cables, actuators = self.decode(gene)
-        temp = Tensegrity('temp', nodes, bars, cables, actuators,
-                          path=self._dirname, solver="Newton", integrator="RK4", stiffness=1, damping=.05)
-        temp.create_xml()
-        env = temp.register_gym(self._gym_des)
-
-        observation, info = env.reset()
-        stable = True
-        for _ in range(1000):
-            observation, reward, terminated, truncated, info = env.step(action=np.zeros(env.action_space.shape))
-            if terminated:
-                stable = False
-                break
-
-        env.close()
-        temp.clean(self._gym_des, clean_file=True)
-
-        if stable:
-            return bounding_box(nodes)
-        else:
-            return 0
-        pass
-
-    def crossover(self, parent1, parent2):
-        crossover_index = self._random.randrange(1, len(parent1))
-        child1 = np.append(parent1[:crossover_index], parent2[crossover_index:])
-        child2 = np.append(parent2[:crossover_index], parent1[crossover_index:])
-        return child1, child2
-
-    def mutate(self, individual):
-        """Reverse the bit of a random index in an individual."""
-        mutate_index = self._random.randrange(3 * self._node_num)
-        individual[mutate_index] = (0, 1)[individual[mutate_index] == 0]
-
-    def random_selection(self, population):
-        """Select and return a random member of the population."""
-        return self._random.choice(population)
-
-    def tournament_selection(self, population):
-        """Select a random number of individuals from the population and
-        return the fittest member of them all.
+        return self.evaluate(gene)[0]
+
+    def crossover(self, parents_1, parents_2):
+        """One-point crossover of each pair of rows in `parents_1` and `parents_2`."""
+        crossover_index = self._rng.integers(1, parents_1.shape[1], size=(len(parents_1), 1))
+        swap = np.arange(parents_1.shape[1]) >= crossover_index
+        child_1 = np.where(swap, parents_2, parents_1)
+        child_2 = np.where(swap, parents_1, parents_2)
+        return child_1, child_2
+
+    def mutate(self, individuals):
+        """Reverse the bit of a random index in each individual (row), in place."""
+        rows = np.arange(len(individuals))
+        mutate_index = self._rng.integers(3 * self._node_num, size=len(individuals))
+        individuals[rows, mutate_index] = individuals[rows, mutate_index] == 0
+
+    def random_selection(self, size):
+        """Select `size` random members of the population and return their indices."""
+        return self._rng.integers(len(self._genes), size=size)
+
+    def tournament_selection(self, size):
+        """Hold `size` tournaments, each among a random number of distinct individuals
+        from the population, and return the indices of the fittest member of each.
         """
-        members = self._random.sample(population, self._tournament_size)
-        members.sort(
-            key=attrgetter('fitness'), reverse=self._maximize_fitness)
-        return members[0]
+        population_size = len(self._genes)
+        if self._tournament_size > population_size:
+            raise ValueError("Tournament size larger than population")
+
+        if self._tournament_size ** 2 > population_size:
+            # duplicates are likely, take the first members of a random permutation of the population in each row
+            members = np.argsort(self._rng.random((size, population_size)), axis=1)[:, :self._tournament_size]
+        else:
+            # draw with replacement and redraw the rows with duplicates, which are at most about half of them
+            members = self._rng.integers(population_size, size=(size, self._tournament_size))
+            redraw = np.arange(size)
+            while len(redraw):
+                ordered = np.sort(members[redraw], axis=1)
+                redraw = redraw[(ordered[:, 1:] == ordered[:, :-1]).any(axis=1)]
+                members[redraw] = self._rng.integers(population_size, size=(len(redraw), self._tournament_size))
+
+        fitness = self._fitness[members]
+        winner = fitness.argmax(axis=1) if self._maximize_fitness else fitness.argmin(axis=1)
+        return members[np.arange(size), winner]
 
     def create_initial_population(self):
         """Create members of the first population randomly"""
-        initial_population = []
-        for _ in range(self._population_size):
-            gene = self.create_individual()
-            individual = Chromosome(gene)
-            initial_population.append(individual)
-        self._current_generation = initial_population
+        self._genes = self.create_population(self._population_size)
+        self._fitness = np.zeros(self._population_size)
+
+    def _key(self, nodes, bars, cables):
+        """Cache key of a decoded tensegrity"""
+        if self._canonical is not None:
+            return self._canonical.key(nodes, bars, cables, self._sim_params)
+        return structure_key(nodes, bars, cables, self._sim_params)
+
+    def diversity(self):
+        """Fraction of distinct designs in the population, by canonical keys with labels and yaw removed,
+           whatever the `canonical` of the fitness cache.
+        """
+        canonical = Canonicalizer("yaw")
+        nodes, bars, cables, _ = self.decode_batch(self._genes)
+        keys = {canonical.key(nodes[i], bars[i], cables[i], self._sim_params) for i in range(len(self._genes))}
+        return len(keys) / len(self._genes)
 
     def calculate_population_fitness(self, n_workers=None, parallel_type="processing"):
         """Calculate the fitness of every member of the given population using
            the supplied fitness_function.
         """
-        if n_workers == 1:
-            for individual in self._current_generation:
-                individual.fitness = self.fitness(individual.genes)
-        else:
-            if "process" in parallel_type.lower():
-                executor = futures.ProcessPoolExecutor(max_workers=n_workers)
+        if self._cache is None:
+            self._fitness, _, _ = self._simulate(np.arange(len(self._genes)), n_workers, parallel_type)
+            self._cache_stats = (None, None)
+            return
+
+        # look up every distinct structure once, and only simulate the missing ones
+        self._cache.reset_stats()
+        nodes, bars, cables, _ = self.decode_batch(self._genes)
+        keys = [self._key(nodes[i], bars[i], cables[i]) for i in range(len(self._genes))]
+        fitness = np.empty(len(self._genes))
+        missing = {}
+        for i, key in enumerate(keys):
+            if key in missing:
+                missing[key].append(i)
+                continue
+            value = self._cache.get(key)
+            if value is None:
+                missing[key] = [i]
             else:
-                executor = futures.ThreadPoolExecutor(max_workers=n_workers)
-                # Create two lists from the same size to be passed as args to the
-                # map function.
-            genes = [individual.genes for individual in self._current_generation]
+                fitness[i] = value
+
+        first = np.asarray([members[0] for members in missing.values()], dtype=int)
+        results, simulated, reference = self._simulate(first, n_workers, parallel_type, (nodes, bars, cables))
+        for (key, members), result, cached in zip(missing.items(), results, reference):
+            fitness[members] = result
+            # designs skipped by the surrogate or eliminated at a cheap rung have no reference fitness
+            if cached:
+                self._cache.put(key, result)
+        self._cache.flush()
+
+        self._fitness = fitness
+        self._cache_stats = (len(self._genes) - len(first), int(simulated.sum()))
+
+    def _simulate(self, indices, n_workers=None, parallel_type="processing", decoded=None):
+        """Simulate the members at `indices`, those chosen by the surrogate if any, by successive halving
+           if `multi_fidelity` is set. Returns the fitness of all of them, 0 for skipped ones, the mask of
+           simulated ones and the mask of those simulated at the reference fidelity.
+        """
+        simulated = np.ones(len(indices), dtype=bool)
+        if self._surrogate is not None:
+            nodes, bars, cables = decoded if decoded is not None else self.decode_batch(self._genes)[:3]
+            features = np.asarray([structural_features(nodes[i], bars[i], cables[i]) for i in indices])
+            # the elite keeps its fitness when it has to be simulated again
+            keep = (indices == 0) if self._elitism and self._generation > 0 else None
+            simulated = self._surrogate.select(features, self._rng, keep=keep)
+
+        fitness = np.zeros(len(indices))
+        reference = simulated.copy()
+        if self._multi_fidelity is None:
+            fitness[simulated] = self._evaluate(self._genes[indices[simulated]], n_workers, parallel_type,
+                                                indices=indices[simulated])
+        else:
+            fitness[simulated], reference[simulated] = self._evaluate_multi_fidelity(
+                indices[simulated], n_workers, parallel_type)
+
+        if self._surrogate is not None:
+            self._surrogate.update(features[simulated], fitness[simulated])
+        return fitness, simulated, reference
 
-            with executor as pool:
-                results = pool.map(self.fitness, genes)
+    def _evaluate_multi_fidelity(self, indices, n_workers=None, parallel_type="processing"):
+        """Evaluate the members at `indices` by successive halving, with the evaluation stats of all rungs.
+           Returns their fitness and the mask of those that reached the reference fidelity.
+        """
+        rungs = []
+
+        def evaluate(positions, level):
+            fitness = self._evaluate(self._genes[indices[positions]], n_workers, parallel_type,
+                                     indices=indices[positions], level=level)
+            rungs.append((self._eval_stats, self._steps_stats[0]))
+            return fitness
+
+        fitness, reached = self._multi_fidelity.run(len(indices), evaluate, self._maximize_fitness)
+
+        wall = sum(stats["evaluation_wall"] for stats, _ in rungs)
+        phases = {}
+        for stats, _ in rungs:
+            for phase, seconds in stats["evaluation_phases"].items():
+                phases[phase] = phases.get(phase, 0) + seconds
+        # compared to simulating every member at the reference fidelity
+        self._steps_stats = (sum(steps for _, steps in rungs), len(indices) * self._stability.max_steps)
+        self._eval_stats = dict(
+            evaluations=sum(stats["evaluations"] for stats, _ in rungs),
+            evaluation_phases=phases,
+            workers=rungs[0][0]["workers"] if rungs else self._n_workers,
+            evaluation_wall=wall,
+            worker_utilization=sum(stats["worker_utilization"] * stats["evaluation_wall"]
+                                   for stats, _ in rungs) / wall if wall else 0,
+            straggler_time=sum(stats["straggler_time"] for stats, _ in rungs),
+        )
+        return fitness, reached == len(self._multi_fidelity.levels)
+
+    def _create_pool(self, n_workers=None, parallel_type="processing"):
+        if _pool_type(parallel_type) == "process":
+            context = None
+            if parallel_type.lower() == "forkserver":
+                # the server starts with the first pool, later calls of set_forkserver_preload have no effect
+                context = mp.get_context("forkserver")
+                context.set_forkserver_preload(FORKSERVER_PRELOAD)
+            # workers get a copy of the GA once, tasks only carry genes
+            return futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+                                               initializer=_init_worker, initargs=(self,))
+        else:
+            return futures.ThreadPoolExecutor(max_workers=n_workers)
+
+    def worker_config(self):
+        """Settings a remote worker needs to evaluate genes like this GA, as JSON-serializable dict"""
+        if self._from_xml:
+            raise ValueError("Remote workers only evaluate in memory, without from_xml")
+        return {
+            "strut_num": self._strut_num,
+            "eval_seed": self._sim_params["seed"],
+            "stability": list(self._stability.params),
+            "prefilter": list(self._prefilter.params) if self._prefilter is not None else None,
+            "multi_fidelity": [[list(level) for level in self._multi_fidelity.levels], self._multi_fidelity.params[1]]
+            if self._multi_fidelity is not None else None,
+            "compiled_cache_dir": self._compiled_cache.directory if self._compiled_cache is not None else None,
+        }
+
+    @classmethod
+    def from_worker_config(cls, config):
+        """GA evaluating genes with the settings of `worker_config`"""
+        return cls(
+            config["strut_num"],
+            eval_seed=config["eval_seed"],
+            stability=StabilityEvaluator(*config["stability"]),
+            prefilter=EquilibriumPrefilter(*config["prefilter"]) if config["prefilter"] is not None else None,
+            multi_fidelity=SuccessiveHalving([FidelityLevel(*level) for level in config["multi_fidelity"][0]],
+                                             config["multi_fidelity"][1])
+            if config.get("multi_fidelity") is not None else None,
+            compiled_cache_dir=config.get("compiled_cache_dir"),
+            cache_size=0,
+        )
 
-            for individual, result in zip(self._current_generation, results):
-                individual.fitness = result
+    def open_pool(self, n_workers=None, parallel_type="processing", evaluator=None):
+        """Start a pool of workers that is reused by every evaluation until `close_pool`,
+           or use the remote workers of a `DistributedEvaluator`
+        """
+        self.close_pool()
+        if evaluator is not None:
+            evaluator.configure(self)
+            self._pool = evaluator
+            self._pool_type = "remote"
+            self._n_workers = max(evaluator.workers, 1)
+        elif n_workers != 1:
+            self._pool = self._create_pool(n_workers, parallel_type)
+            self._pool_type = _pool_type(parallel_type)
+            self._n_workers = self._pool._max_workers
+
+    def close_pool(self):
+        if self._pool is not None:
+            # an evaluator is closed by its owner
+            if self._pool_type != "remote":
+                self._pool.shutdown()
+            self._pool = None
+            self._pool_type = None
+            self._n_workers = 1
+
+    def _record_evaluation(self, index, value, result, timing):
+        """Count pre-filter decisions and report an evaluation to observers"""
+        if timing["prefilter"] is not None:
+            stats = self._prefilter_stats
+            stats["checked"] += 1
+            if timing["prefilter"] == "feasible":
+                stats["false_accepts"] += not result.stable
+            elif result.reason == "prefilter":
+                stats["rejected"] += 1
+            else:
+                stats["audited"] += 1
+                stats["false_rejects"] += bool(result.stable)
+
+        self._notify("on_evaluation", dict(
+            timing,
+            generation=self._generation,
+            index=index,
+            fitness=float(value),
+            stable=bool(result.stable),
+            steps=int(result.steps),
+            reason=result.reason,
+        ))
+
+    def _submit(self, pool, pool_type, index, gene, level=None):
+        """Submit the evaluation of a gene, the future returns (index, `_evaluate_timed` result)"""
+        if pool_type == "process":
+            return pool.submit(_evaluate_in_worker, index, gene, level)
+        if pool_type == "remote":
+            return pool.submit(index, gene, level)
+        return pool.submit(lambda: (index, self._evaluate_timed(gene, level)))
+
+    def _map(self, pool, pool_type, genes, level=None):
+        """Evaluate genes in the pool, yielding results as they complete"""
+        tasks = [self._submit(pool, pool_type, i, gene, level) for i, gene in enumerate(genes)]
+        for task in futures.as_completed(tasks):
+            yield task.result()
+
+    def _evaluate(self, genes, n_workers=None, parallel_type="processing", indices=None, level=None):
+        """Simulate each of the genes, at a rung of `multi_fidelity` if `level` is given, and return the
+           fitness vector
+        """
+        start = time.perf_counter()
+        if self._pool_type == "remote":
+            # workers may join or leave between generations
+            self._n_workers = max(self._pool.workers, 1)
+        if self._pool is not None:
+            workers = self._n_workers
+            stream = self._map(self._pool, self._pool_type, genes, level)
+        elif n_workers == 1:
+            workers = 1
+            stream = ((i, self._evaluate_timed(gene, level)) for i, gene in enumerate(genes))
+        else:
+            pool_type = _pool_type(parallel_type)
+            pool = self._create_pool(n_workers, parallel_type)
+            workers = pool._max_workers
+            stream = self._map(pool, pool_type, genes, level)
+
+        fitness = np.zeros(len(genes))
+        steps = 0
+        busy = 0
+        completed = []
+        phases = {}
+        for i, (value, result, timing) in stream:
+            completed.append(time.perf_counter() - start)
+            fitness[i] = value
+            steps += result.steps
+            busy += timing["end"] - timing["start"]
+            for phase, seconds in timing["phases"].items():
+                phases[phase] = phases.get(phase, 0) + seconds
+            self._record_evaluation(int(indices[i]) if indices is not None else i, value, result, timing)
+        if self._pool is None and n_workers != 1:
+            pool.shutdown()
+        wall = time.perf_counter() - start
+
+        # after the (n - workers + 1)-th completion there is nothing left to start and workers go idle
+        straggler = completed[-1] - completed[max(len(completed) - workers, 0)] if completed else 0
+        self._steps_stats = (steps, len(genes) * self._stability.max_steps)
+        self._eval_stats = dict(
+            evaluations=len(genes),
+            evaluation_phases=phases,
+            workers=workers,
+            evaluation_wall=wall,
+            worker_utilization=busy / (wall * workers) if completed else 0,
+            straggler_time=straggler,
+        )
+        return fitness
 
     def rank_population(self):
         """Sort the population by fitness according to the order defined by
-                maximise_fitness.
+                maximise_fitness, and return the permutation applied.
         """
-        self._current_generation.sort(
-            key=attrgetter('fitness'), reverse=self._maximize_fitness
-        )
+        order = np.argsort(-self._fitness if self._maximize_fitness else self._fitness, kind='stable')
+        self._genes = self._genes[order]
+        self._fitness = self._fitness[order]
+        return order
 
     def create_new_population(self):
         """Create a new population using the genetic operators (selection,
         crossover, and mutation) supplied.
         """
-        new_population = []
-        elite = copy.deepcopy(self._current_generation[0])
+        pair_num = (self._population_size + 1) // 2
         selection = self.tournament_selection
 
-        while len(new_population) < self._population_size:
-            parent_1 = copy.deepcopy(selection(self._current_generation))
-            parent_2 = copy.deepcopy(selection(self._current_generation))
+        # fancy indexing copies the parents, pairs of children are children[:, 0] and children[:, 1]
+        children = self._genes[selection(2 * pair_num)].reshape(pair_num, 2, self._gene_len)
 
-            child_1, child_2 = parent_1, parent_2
-            child_1.fitness, child_2.fitness = 0, 0
+        can_crossover = np.flatnonzero(self._rng.random(pair_num) < self._crossover_probability)
+        can_mutate = np.flatnonzero(self._rng.random(pair_num) < self._mutation_probability)
 
-            can_crossover = self._random.random() < self._crossover_probability
-            can_mutate = self._random.random() < self._mutation_probability
-
-            if can_crossover:
-                child_1.genes, child_2.genes = self.crossover(parent_1.genes, parent_2.genes)
+        children[can_crossover, 0], children[can_crossover, 1] = self.crossover(
+            children[can_crossover, 0], children[can_crossover, 1]
+        )
 
-            if can_mutate:
-                self.mutate(child_1.genes)
-                self.mutate(child_2.genes)
+        mutants = children[can_mutate].reshape(-1, self._gene_len)
+        self.mutate(mutants)
+        children[can_mutate] = mutants.reshape(-1, 2, self._gene_len)
 
-            new_population.append(child_1)
-            if len(new_population) < self._population_size:
-                new_population.append(child_2)
+        new_genes = children.reshape(-1, self._gene_len)[:self._population_size]
+        new_fitness = np.zeros(self._population_size)
 
         if self._elitism:
-            new_population[0] = elite
+            new_genes[0] = self._genes[0]
+            new_fitness[0] = self._fitness[0]
+
+        self._genes = new_genes
+        self._fitness = new_fitness
+
+    def create_child(self):
+        """Breed a single child from two tournament winners of the current population."""
+        child_1, child_2 = self._genes[self.tournament_selection(2)][:, np.newaxis]
+        if self._rng.random() < self._crossover_probability:
+            child_1, _ = self.crossover(child_1, child_2)
+        if self._rng.random() < self._mutation_probability:
+            self.mutate(child_1)
+        return child_1[0]
+
+    def replace_member(self, gene, fitness):
+        """Put an evaluated child in the (ranked) population in place of the worst member,
+           or of a random member without elitism, and keep the population ranked.
+           Return the index of the child in the ranked population, or None if it was not inserted.
+        """
+        if self._elitism:
+            index = len(self._genes) - 1
+            # the elite is only replaced by a better child
+            better = fitness > self._fitness[0] if self._maximize_fitness else fitness < self._fitness[0]
+            if index == 0 and not better:
+                return None
+        else:
+            index = self._rng.integers(len(self._genes))
+        self._genes[index] = gene
+        self._fitness[index] = fitness
+        return int(np.flatnonzero(self.rank_population() == index)[0])
+
+    def _run_steady_state(self, evaluations):
+        """
+        Breed and evaluate `evaluations` children one at a time, without a generation barrier
+        Args:
+            evaluations: number of children
+
+        .. note::
 
-        self._current_generation = new_population
+            A child is bred as soon as a worker is free and replaces a population member as soon as its
+            fitness arrives, see `create_child` and `replace_member`. Children skipped by the surrogate are
+            counted but dropped, they never evict a simulated member. Every `population_size` children are
+            reported to observers as one generation.
+
+        """
+        if self._pool_type == "remote":
+            self._n_workers = max(self._pool.workers, 1)
+        workers = self._n_workers if self._pool is not None else 1
+        in_flight = {}
+        submitted = received = 0
+        window = None
+
+        def start_window():
+            return dict(timer=PhaseTimer(), start=time.perf_counter(), epoch=time.time(), simulations=0, hits=0,
+                        steps=0, busy=0, phases={})
+
+        def receive(gene, key, value, result, timing, features=None):
+            nonlocal received, window
+            if result is None:
+                # a cache hit has its simulated fitness, a design skipped by the surrogate has none and is dropped
+                if features is None:
+                    window["hits"] += 1
+                    with window["timer"].phase("ranking"):
+                        self.replace_member(gene, value)
+            else:
+                if features is not None:
+                    self._surrogate.update(features, [value])
+                window["simulations"] += 1
+                window["steps"] += result.steps
+                # only the part of evaluations in flight across windows that falls in this window
+                window["busy"] += timing["end"] - max(timing["start"], window["epoch"])
+                for phase, seconds in timing["phases"].items():
+                    window["phases"][phase] = window["phases"].get(phase, 0) + seconds
+                if self._cache is not None:
+                    self._cache.put(key, value)
+                with window["timer"].phase("ranking"):
+                    index = self.replace_member(gene, value)
+                self._record_evaluation(index, value, result, timing)
+            received += 1
+
+            if received % self._population_size == 0 or received == evaluations:
+                wall = time.perf_counter() - window["start"]
+                self._steps_stats = (window["steps"], window["simulations"] * self._stability.max_steps)
+                if self._cache is not None:
+                    self._cache_stats = (window["hits"], window["simulations"])
+                    self._cache.flush()
+                else:
+                    self._cache_stats = (None, None)
+                self._eval_stats = dict(
+                    evaluations=window["simulations"],
+                    evaluation_phases=window["phases"],
+                    workers=workers,
+                    evaluation_wall=wall,
+                    worker_utilization=window["busy"] / (wall * workers) if window["simulations"] else 0,
+                    # there is no barrier to wait for
+                    straggler_time=0,
+                )
+                self._end_generation(window["timer"])
+                window = start_window()
+
+        window = start_window()
+        while received < evaluations:
+            while submitted < evaluations and len(in_flight) < workers:
+                with window["timer"].phase("variation"):
+                    gene = self.create_child()
+                    key = value = features = None
+                    if self._cache is not None or self._surrogate is not None:
+                        nodes, bars, cables, _ = self.decode(gene)
+                    if self._cache is not None:
+                        key = self._key(nodes, bars, cables)
+                        value = self._cache.get(key)
+                    if value is None and self._surrogate is not None:
+                        features = structural_features(nodes, bars, cables)
+                        if not self._surrogate.accept(features, self._rng):
+                            value = 0.
+                submitted += 1
+                if value is not None:
+                    receive(gene, key, value, None, None, features)
+                elif self._pool is None:
+                    with window["timer"].phase("evaluation"):
+                        value, result, timing = self._evaluate_timed(gene)
+                    receive(gene, key, value, result, timing, features)
+                else:
+                    in_flight[self._submit(self._pool, self._pool_type, submitted, gene)] = (gene, key, features)
+
+            if in_flight:
+                with window["timer"].phase("evaluation"):
+                    done, _ = futures.wait(in_flight, return_when=futures.FIRST_COMPLETED)
+                for task in done:
+                    gene, key, features = in_flight.pop(task)
+                    _, (value, result, timing) = task.result()
+                    receive(gene, key, value, result, timing, features)
+
+    def _end_generation(self, timer):
+        """Report the generation to observers and count it"""
+        record = dict(
+            generation=self._generation,
+            best_fitness=float(self._fitness[0]),
+            mean_fitness=float(self._fitness.mean()),
+            cache_hits=self._cache_stats[0],
+            cache_misses=self._cache_stats[1],
+            steps=self._steps_stats[0],
+            max_steps=self._steps_stats[1],
+            prefilter=dict(self._prefilter_stats) if self._prefilter is not None else None,
+            diversity=self.diversity() if self._canonical is not None else None,
+            surrogate=self._surrogate.stats if self._surrogate is not None else None,
+            fidelity=self._multi_fidelity.stats if self._multi_fidelity is not None else None,
+            phases=timer.phases,
+        )
+        record.update(self._eval_stats)
+        self._notify("on_generation", record)
+        self._generation += 1
 
     def create_first_generation(self, n_workers=None, parallel_type="processing"):
         """Create the first population, calculate the population's fitness and
                 rank the population by fitness according to the order specified.
         """
-        self.create_initial_population()
-        self.calculate_population_fitness(
-            n_workers=n_workers, parallel_type=parallel_type
-        )
-        self.rank_population()
+        timer = PhaseTimer()
+        with timer.phase("initialization"):
+            self.create_initial_population()
+        with timer.phase("evaluation"):
+            self.calculate_population_fitness(
+                n_workers=n_workers, parallel_type=parallel_type
+            )
+        with timer.phase("ranking"):
+            self.rank_population()
+        self._end_generation(timer)
 
     def create_next_generation(self, n_workers=None, parallel_type="processing"):
         """Create subsequent populations, calculate the population fitness and
            rank the population by fitness in the order specified.
         """
-        self.create_new_population()
-        self.calculate_population_fitness(
-            n_workers=n_workers, parallel_type=parallel_type
-        )
-        self.rank_population()
-        if self._verbose:
-            print("Fitness: %f" % self.best_individual[0])
-
-    def run(self, n_workers=None, parallel_type="processing"):
-        """Run (solve) the Genetic Algorithm."""
-        self.create_first_generation(
-            n_workers=n_workers, parallel_type=parallel_type
-        )
-
-        for _ in range(1, self._generations):
-            self.create_next_generation(
+        timer = PhaseTimer()
+        with timer.phase("variation"):
+            self.create_new_population()
+        with timer.phase("evaluation"):
+            self.calculate_population_fitness(
                 n_workers=n_workers, parallel_type=parallel_type
             )
+        with timer.phase("ranking"):
+            self.rank_population()
+        self._end_generation(timer)
+
+    def load_checkpoint(self, directory=None):
+        """Restore the population, RNG state and generation counter from a checkpoint.
+           Returns the number of generations restored, 0 if there is no checkpoint.
+        """
+        return load_checkpoint(self, directory if directory is not None else self._checkpoint_dir)
+
+    def run(self, n_workers=None, parallel_type="processing", resume=False, steady_state=False, evaluator=None):
+        """Run (solve) the Genetic Algorithm, with one pool of workers for the whole run.
+           With `resume`, continue from the checkpoint in `checkpoint_dir` if there is one.
+           With `steady_state`, children after the first generation are bred and evaluated
+           asynchronously, `population_size` per remaining generation.
+           With `evaluator`, a `DistributedEvaluator`, genes are evaluated by its remote workers.
+           `parallel_type` is "processing", "threading" or "forkserver", processes forked from a server
+           that has imported MuJoCo, Gymnasium and the GA once (see `FORKSERVER_PRELOAD`).
+        """
+        self._generation = 0
+        if resume:
+            self.load_checkpoint()
+
+        self._notify("on_run_start")
+        self.open_pool(n_workers=n_workers, parallel_type=parallel_type, evaluator=evaluator)
+        try:
+            if self._generation == 0:
+                self.create_first_generation(
+                    n_workers=n_workers, parallel_type=parallel_type
+                )
+
+            if steady_state:
+                self._run_steady_state((self._generations - self._generation) * self._population_size)
+            else:
+                for _ in range(self._generation, self._generations):
+                    self.create_next_generation(
+                        n_workers=n_workers, parallel_type=parallel_type
+                    )
+        finally:
+            self.close_pool()
+            if self._cache is not None:
+                self._cache.flush()
+            self._close_recorders()
+            self._notify("on_run_end")
 
     @property
     def best_individual(self):
         """Return the individual with the best fitness in the current
            generation.
         """
-        best = self._current_generation[0]
-        return best.fitness, best.genes
-        pass
+        return self._fitness[0], self._genes[0]
+
+    @property
+    def generation(self):
+        """Return the number of generations evaluated so far."""
+        return self._generation
+
+    @property
+    def cache_stats(self):
+        """Return fitness cache hits and misses (simulations) of the last evaluated generation."""
+        return self._cache_stats
+
+    @property
+    def steps_stats(self):
+        """Return env steps simulated in the last evaluated generation, and the steps a fixed horizon
+        of `max_steps` would have taken for the same simulations.
+        """
+        return self._steps_stats
+
+    @property
+    def prefilter_stats(self):
+        """Return counts of the pre-filter over the run: designs checked, rejected without simulation,
+        rejected but simulated for audit, audited designs the simulator found stable (false rejects) and
+        designs accepted that the simulator found unstable (false accepts).
+        """
+        return dict(self._prefilter_stats)
+
+    @property
+    def surrogate_stats(self):
+        """Return counts of the surrogate over the run: designs simulated and skipped, and the error of its
+        predictions on simulated designs, see `SurrogateModel.stats`. None without a surrogate.
+        """
+        return self._surrogate.stats if self._surrogate is not None else None
+
+    @property
+    def fidelity_stats(self):
+        """Return the number of rollouts at each rung of `multi_fidelity` over the run, the reference rollout
+        last. None without multi-fidelity evaluation.
+        """
+        return self._multi_fidelity.stats if self._multi_fidelity is not None else None
 
     @property
     def last_generation(self):
         """Return members of the last generation as a generator function."""
-        return ((member.fitness, member.genes) for member
-                in self._current_generation)
-        pass
+        return ((fitness, genes) for fitness, genes
+                in zip(self._fitness, self._genes))